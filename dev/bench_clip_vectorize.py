@@ -0,0 +1,83 @@
+## Measures object vectorization throughput against a local stand-in for the multi2vec-clip
+## inference service: one object per request (as Weaviate's module does on insert) versus
+## batched requests with several in flight.  The stand-in charges a fixed latency per request
+## plus a cost per text and image, roughly the shape of the real service on CPU.
+## Usage: python dev/bench_clip_vectorize.py [n_listings] [request_ms] [item_ms]
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import json
+import sys
+import threading
+import time
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parents[1] / 'streamlit'))
+from fundalytics_clip import ClipClient, vectorize_objects
+from bench_import import COLLECTION_DEF_FILE, fixture_listings
+
+
+VECTOR_DIM = 512
+
+def stand_in_server(request_ms: float, item_ms: float) -> ThreadingHTTPServer:
+
+    #a single worker model serializes inference, as the real service does
+    model_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            texts, images = body.get('texts', []), body.get('images', [])
+
+            time.sleep(request_ms / 1000)
+            with model_lock:
+                time.sleep(item_ms * (len(texts) + len(images)) / 1000)
+
+            rng = np.random.default_rng(len(texts) + len(images))
+            payload = json.dumps({
+                'textVectors': rng.random((len(texts), VECTOR_DIM)).round(6).tolist(),
+                'imageVectors': rng.random((len(images), VECTOR_DIM)).round(6).tolist(),
+                }).encode('utf-8')
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+if __name__ == '__main__':
+    n_listings = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    request_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 20
+    item_ms = float(sys.argv[3]) if len(sys.argv) > 3 else 2
+
+    with open(COLLECTION_DEF_FILE) as f:
+        collection_def = json.load(f)
+
+    ingest_df = fixture_listings(n_listings)
+    server = stand_in_server(request_ms=request_ms, item_ms=item_ms)
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    print(f"{n_listings} fixture listings, {request_ms:g} ms per request + {item_ms:g} ms per text/image")
+    for batch_size, max_in_flight in [(1, 1), (8, 1), (32, 1), (32, 4), (64, 8)]:
+        clip_client = ClipClient(url=url, pool_size=max_in_flight)
+        start = time.perf_counter()
+        vectors = vectorize_objects(
+            clip_client=clip_client,
+            df=ingest_df,
+            collection_def=collection_def,
+            batch_size=batch_size,
+            max_in_flight=max_in_flight)
+        elapsed = time.perf_counter() - start
+        assert vectors.shape == (n_listings, VECTOR_DIM)
+        print(f"batch {batch_size:3d}, {max_in_flight} in flight: {elapsed:8.2f} s {n_listings / elapsed:10.1f} listings/s")
+
+    server.shutdown()
@@ -0,0 +1,92 @@
+## Measures the image preprocessing stage on synthetic listing photos: payload bytes before
+## and after shrinking to CLIP's 224px input, images dropped as corrupt or placeholders and
+## preprocessing time per pool size.  With 'import' it also times a Weaviate import of the
+## raw and preprocessed payloads (requires the dev stack: docker compose -f dev/docker-compose.yml up).
+## Usage: python dev/bench_image_preprocess.py [n_images] [width] [import]
+
+from pathlib import Path
+import base64
+import io
+import json
+import sys
+import time
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).parents[1] / 'streamlit'))
+from fundalytics_images import ImagePreprocessor
+
+
+def fixture_photos(n_images: int, width: int, seed: int = 42) -> dict:
+    rng = np.random.default_rng(seed)
+    height = width * 2 // 3
+    photos = {}
+    for i in range(n_images):
+        #smooth colour fields with sensor-like noise compress roughly like real photos
+        coarse = rng.integers(0, 256, (6, 9, 3), dtype=np.uint8)
+        pixels = np.asarray(Image.fromarray(coarse).resize((width, height), Image.Resampling.BICUBIC), dtype=np.int16)
+        pixels = np.clip(pixels + rng.normal(0, 6, pixels.shape), 0, 255).astype(np.uint8)
+        output = io.BytesIO()
+        Image.fromarray(pixels).save(output, format='JPEG', quality=95)
+        photos[f"https://cloud.funda.nl/valentina_media/{i}_{width}.jpg"] = output.getvalue()
+
+    #a truncated download and a blank placeholder per 50 photos
+    for i in range(max(1, n_images // 50)):
+        photos[f"https://cloud.funda.nl/corrupt/{i}.jpg"] = next(iter(photos.values()))[:200]
+        output = io.BytesIO()
+        Image.new('RGB', (width, height), (238, 238, 238)).save(output, format='JPEG')
+        photos[f"https://cloud.funda.nl/placeholder/{i}.jpg"] = output.getvalue()
+
+    return photos
+
+def time_import(images: dict, collection_def: dict) -> float:
+    import weaviate
+    from weaviate.util import generate_uuid5
+
+    with weaviate.connect_to_local() as weaviate_client:
+        if weaviate_client.collections.exists(name=collection_def['class']):
+            weaviate_client.collections.delete(collection_def['class'])
+        collection = weaviate_client.collections.create_from_dict(collection_def)
+
+        start = time.perf_counter()
+        with collection.batch.dynamic() as batch:
+            for url, content in images.items():
+                batch.add_object(
+                    uuid=generate_uuid5(url),
+                    properties={'house_id': url, 'image_enc': base64.b64encode(content).decode('utf-8')})
+        elapsed = time.perf_counter() - start
+
+        weaviate_client.collections.delete(collection_def['class'])
+
+    return elapsed
+
+if __name__ == '__main__':
+    n_images = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 720
+    run_import = len(sys.argv) > 3 and sys.argv[3] == 'import'
+
+    photos = fixture_photos(n_images, width)
+    raw_bytes = sum(len(content) for content in photos.values())
+    print(f"{len(photos)} fixture photos at {width}px wide, {raw_bytes / 1024:.0f} KB")
+
+    for max_workers in [1, 2, 4]:
+        preprocessor = ImagePreprocessor(max_workers=max_workers)
+        preprocessor.process_many(dict(list(photos.items())[:max_workers]))
+        start = time.perf_counter()
+        processed, dropped = preprocessor.process_many(photos)
+        elapsed = time.perf_counter() - start
+        preprocessor.close()
+        print(f"{max_workers} workers: {elapsed:8.2f} s {len(photos) / elapsed:8.1f} images/s")
+
+    processed_bytes = sum(len(content) for content in processed.values())
+    print(f"kept {len(processed)}, dropped {len(dropped)}: {raw_bytes / 1024:.0f} KB -> "
+          f"{processed_bytes / 1024:.0f} KB ({1 - processed_bytes / raw_bytes:.0%} smaller, "
+          f"base64 adds a third to both)")
+
+    if run_import:
+        with open(Path(__file__).parents[1] / 'streamlit' / 'collection_def.json') as f:
+            collection_def = json.load(f)
+        raw_import = time_import({url: photos[url] for url in processed}, collection_def)
+        processed_import = time_import(processed, collection_def)
+        print(f"import raw:          {raw_import:8.2f} s")
+        print(f"import preprocessed: {processed_import:8.2f} s ({1 - processed_import / raw_import:.0%} faster)")
@@ -0,0 +1,98 @@
+## Compares the old double import (import, summarize, delete and re-import everything) with
+## a single import followed by a property-only patch of the summary fields.
+## Requires the dev stack: docker compose -f dev/docker-compose.yml up
+## Usage: python dev/bench_import.py [n_listings]
+
+from pathlib import Path
+import base64
+import io
+import json
+import random
+import sys
+import time
+import pandas as pd
+from PIL import Image
+import weaviate
+from weaviate.util import generate_uuid5
+
+sys.path.insert(0, str(Path(__file__).parents[1] / 'streamlit'))
+from fundalytics_ingest import update_properties
+
+
+COLLECTION_DEF_FILE = Path(__file__).parents[1] / 'streamlit' / 'collection_def.json'
+
+WORDS = ['ruime', 'woning', 'tuin', 'balkon', 'keuken', 'badkamer', 'zolder', 'licht', 
+         'centrum', 'rustig', 'gelegen', 'parkeren', 'slaapkamer', 'dakterras', 'garage']
+
+def fixture_listings(n_listings: int, seed: int = 42) -> pd.DataFrame:
+    rng = random.Random(seed)
+    rows = []
+    for i in range(n_listings):
+        image = Image.new('RGB', (180, 120), tuple(rng.randrange(256) for _ in range(3)))
+        image_bytes = io.BytesIO()
+        image.save(image_bytes, format='JPEG')
+        house_id = str(40000000 + i)
+        rows.append({
+            'house_id': house_id,
+            'uuid': generate_uuid5(house_id),
+            'url': f"https://www.funda.nl/koop/amsterdam/huis-{house_id}/",
+            'city': 'amsterdam',
+            'price': float(rng.randrange(200000, 2000000, 5000)),
+            'living_area': float(rng.randrange(40, 250)),
+            'bedroom': rng.randrange(1, 6),
+            'descrip': ' '.join(rng.choice(WORDS) for _ in range(200)),
+            'image_url': f"https://cloud.funda.nl/valentina_media/{house_id}_180x120.jpg",
+            'image_enc': base64.b64encode(image_bytes.getvalue()).decode('utf-8'),
+            })
+    return pd.DataFrame(rows)
+
+def create_collection(weaviate_client, collection_def):
+    if weaviate_client.collections.exists(name=collection_def['class']):
+        weaviate_client.collections.delete(collection_def['class'])
+    return weaviate_client.collections.create_from_dict(collection_def)
+
+def insert_objects(collection, ingest_df):
+    with collection.batch.dynamic() as batch:
+        for data_row in ingest_df.to_dict('records'):
+            batch.add_object(uuid=data_row['uuid'], properties=data_row)
+
+def add_summaries(ingest_df):
+    ingest_df['description_summary'] = ingest_df['descrip'].str[:80]
+    ingest_df['linked_image'] = ingest_df['image_url']
+    return ingest_df
+
+if __name__ == '__main__':
+    n_listings = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+    with open(COLLECTION_DEF_FILE) as f:
+        collection_def = json.load(f)
+
+    ingest_df = fixture_listings(n_listings)
+
+    with weaviate.connect_to_local() as weaviate_client:
+
+        start = time.perf_counter()
+        collection = create_collection(weaviate_client, collection_def)
+        insert_objects(collection, ingest_df)
+        summary_df = add_summaries(ingest_df.copy())
+        collection = create_collection(weaviate_client, collection_def)
+        insert_objects(collection, summary_df)
+        double_import = time.perf_counter() - start
+
+        start = time.perf_counter()
+        collection = create_collection(weaviate_client, collection_def)
+        insert_objects(collection, ingest_df)
+        summary_df = add_summaries(ingest_df.copy())
+        failures = update_properties(
+            collection=collection,
+            collection_def=collection_def,
+            update_df=summary_df,
+            columns=['description_summary', 'linked_image'])
+        patched_import = time.perf_counter() - start
+
+        weaviate_client.collections.delete(collection_def['class'])
+
+    print(f"{n_listings} fixture listings (summarization time excluded)")
+    print(f"import + full re-import:    {double_import:8.2f} s")
+    print(f"import + property patch:    {patched_import:8.2f} s ({len(failures)} failed updates)")
+    print(f"reduction:                  {1 - patched_import / double_import:8.1%}")
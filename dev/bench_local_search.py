@@ -0,0 +1,95 @@
+## Compares Weaviate near_text/near_image queries with exact search over the local vector
+## snapshot (query vectorized by the CLIP service, then ranked in-process).  Reports median
+## and p95 latency per engine and the recall@k of the local results against Weaviate's.
+## Requires the dev stack: docker compose -f dev/docker-compose.yml up
+## Usage: python dev/bench_local_search.py [n_listings] [n_queries] [k]
+
+from pathlib import Path
+import json
+import random
+import sys
+import tempfile
+import time
+import numpy as np
+import weaviate
+from weaviate.classes.query import MetadataQuery
+
+sys.path.insert(0, str(Path(__file__).parents[1] / 'streamlit'))
+from fundalytics_clip import ClipClient
+from fundalytics_vectors import LocalVectorIndex, VectorSnapshot
+from bench_import import COLLECTION_DEF_FILE, WORDS, create_collection, fixture_listings, insert_objects
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def weaviate_search(collection, query: str, k: int, is_image: bool) -> list:
+    if is_image:
+        response = collection.query.near_image(
+            near_image=query, limit=k, return_properties=['house_id'], return_metadata=MetadataQuery(distance=True))
+    else:
+        response = collection.query.near_text(
+            query=query, limit=k, return_properties=['house_id'], return_metadata=MetadataQuery(distance=True))
+    return [obj.properties['house_id'] for obj in response.objects]
+
+def local_search(clip_client, local_index, query: str, k: int, is_image: bool) -> list:
+    if is_image:
+        _, (query_vector, *_) = clip_client.vectorize(images=[query])
+    else:
+        (query_vector, *_), _ = clip_client.vectorize(texts=[query])
+    return local_index.search(query_vector=query_vector, k=k)['house_id'].tolist()
+
+def report(name: str, latencies: list):
+    latencies = np.array(latencies) * 1000
+    print(f"{name:28s} median {np.median(latencies):8.2f} ms   p95 {np.percentile(latencies, 95):8.2f} ms")
+
+if __name__ == '__main__':
+    n_listings = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    n_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    k = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    with open(COLLECTION_DEF_FILE) as f:
+        collection_def = json.load(f)
+
+    ingest_df = fixture_listings(n_listings)
+
+    rng = random.Random(0)
+    queries = [(' '.join(rng.choice(WORDS) for _ in range(3)), False) for _ in range(n_queries // 2)] \
+        + [(image_enc, True) for image_enc in ingest_df['image_enc'].sample(n_queries - n_queries // 2, random_state=0)]
+
+    clip_client = ClipClient()
+
+    with weaviate.connect_to_local() as weaviate_client, tempfile.TemporaryDirectory() as snapshot_dir:
+
+        collection = create_collection(weaviate_client, collection_def)
+        insert_objects(collection, ingest_df)
+
+        snapshot, build_time = timed(
+            VectorSnapshot.build, collection=collection, version='bench', path=Path(snapshot_dir) / 'snapshot')
+        local_index = LocalVectorIndex(snapshot)
+
+        weaviate_latencies = []
+        local_latencies = []
+        recalls = []
+        for query, is_image in queries:
+            weaviate_ids, weaviate_time = timed(weaviate_search, collection, query, k, is_image)
+            local_ids, local_time = timed(local_search, clip_client, local_index, query, k, is_image)
+            weaviate_latencies.append(weaviate_time)
+            local_latencies.append(local_time)
+            if weaviate_ids:
+                recalls.append(len(set(local_ids) & set(weaviate_ids)) / len(weaviate_ids))
+
+        #ranking alone, with the query vectors computed up front
+        query_vectors = [local_index.vectors[rng.randrange(len(local_index))] for _ in range(n_queries)]
+        rank_latencies = [timed(local_index.search, query_vector, k)[1] for query_vector in query_vectors]
+
+        weaviate_client.collections.delete(collection_def['class'])
+
+    print(f"{n_listings} fixture listings, {len(queries)} queries, k={k}")
+    print(f"snapshot build:              {build_time:8.2f} s")
+    report('weaviate near_text/image', weaviate_latencies)
+    report('clip vectorize + local', local_latencies)
+    report('local ranking only', rank_latencies)
+    print(f"recall@{k} vs weaviate:        {np.mean(recalls):8.1%}")
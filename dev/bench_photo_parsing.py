@@ -0,0 +1,58 @@
+## Micro-benchmark of cover photo extraction on a synthetic nationwide scrape.
+## Usage: python dev/bench_photo_parsing.py [n_listings] [photos_per_listing]
+
+from pathlib import Path
+import random
+import sys
+import timeit
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parents[1] / 'streamlit'))
+from fundalytics_ingest import extract_cover_photos
+
+
+WIDTHS = ['180w', '360w', '720w', '1080w', '1440w']
+
+def synthetic_scrape(n_listings: int, photos_per_listing: int, seed: int = 42) -> pd.DataFrame:
+    rng = random.Random(seed)
+    house_ids = [str(40000000 + i) for i in range(n_listings)]
+    photos = []
+    for house_id in house_ids:
+        entries = []
+        for photo in range(rng.randint(1, photos_per_listing)):
+            base = f"https://cloud.funda.nl/valentina_media/{house_id[-3:]}/{house_id}/{photo:03d}"
+            entries.extend(f"{base}_{width}.jpg {width}" for width in WIDTHS)
+        photos.append(', '.join(entries))
+    return pd.DataFrame({'house_id': house_ids, 'photo': photos}).set_index('house_id')
+
+def legacy_cover_photos(download_df: pd.DataFrame) -> pd.Series:
+    photos_df = download_df['photo'].apply(lambda x: x.split(',')).explode()
+    photos_df = photos_df.apply(lambda x: x.split()).apply(pd.Series)
+    photos_df = photos_df[photos_df[1] == '180w'].drop(1, axis=1)
+
+    cover_photos = photos_df.groupby('house_id').agg(
+        image_url = (0, lambda x: str(x.tolist()[0]))
+        )
+    return cover_photos['image_url']
+
+def vectorized_cover_photos(download_df: pd.DataFrame) -> pd.Series:
+    return extract_cover_photos(download_df['photo']).dropna()
+
+if __name__ == '__main__':
+    n_listings = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    photos_per_listing = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+
+    download_df = synthetic_scrape(n_listings, photos_per_listing)
+
+    pd.testing.assert_series_equal(
+        legacy_cover_photos(download_df).sort_index(),
+        vectorized_cover_photos(download_df).sort_index(),
+        check_names=False)
+
+    legacy = min(timeit.repeat(lambda: legacy_cover_photos(download_df), number=1, repeat=1))
+    vectorized = min(timeit.repeat(lambda: vectorized_cover_photos(download_df), number=1, repeat=3))
+
+    print(f"{n_listings} listings, up to {photos_per_listing} photos x {len(WIDTHS)} sizes each")
+    print(f"explode + apply(pd.Series): {legacy:8.3f} s")
+    print(f"str.extract:                {vectorized:8.3f} s")
+    print(f"speedup:                    {legacy / vectorized:8.1f}x")
@@ -4,30 +4,81 @@ import streamlit as st
 from textwrap import dedent
 from funda_scraper import FundaScraper
 import pandas as pd
-import base64
+from typing import Iterator
+from functools import reduce
+import operator
 import requests
 import weaviate
 from weaviate.embedded import EmbeddedOptions
 from weaviate.util import generate_uuid5
 from weaviate.classes.query import Filter, MetadataQuery
+import base64
 import json
+import os
+import time
 import plotly.express as px
 import numpy as np
-from sklearn.manifold import TSNE
 import validators
 from st_aggrid import AgGrid, GridOptionsBuilder, ColumnsAutoSizeMode
 from st_aggrid.shared import JsCode
-from transformers import BertTokenizer
+from fundalytics_clip import ClipClient, EmbeddingCache, QueryEmbedder, vectorize_objects
+from fundalytics_dedup import DEDUP_SIMILARITY, collapse_duplicates, find_duplicates, image_hashes
+from fundalytics_images import CACHE_DIR, BlobStore, ImageCache, ImageFetcher, ImagePreprocessor, fetch_encoded_images
+from fundalytics_jobs import Job, JobRunner
+from fundalytics_weaviate import SharedWeaviateClient, schema_differences
+from fundalytics_vectors import (
+    Projector,
+    SnapshotStore,
+    available_projection_methods,
+    fetch_dataframe,
+)
+from fundalytics_ingest import (
+    DATA_VERSION,
+    SummaryCache,
+    SummaryFiller,
+    content_hashes,
+    extract_cover_photos,
+    generate_summaries,
+    hash_rows,
+    metadata_properties,
+    prefetch,
+    truncate_descriptions,
+    update_properties,
+)
 
 
 COLLECTION_DEF_FILE = 'streamlit/collection_def.json'
 CITY_LIST_URL = 'https://simplemaps.com/static/data/country-cities/nl/nl.json'
+LISTING_PAGE_SIZES = [25, 50, 100, 500]
+
+#the embedded instance keeps its data, and the parameters of the import it holds, here
+#so a restarted app reattaches to the last import instead of re-ingesting
+DATA_DIR = Path(os.environ.get('FUNDALYTICS_DATA_DIR', Path.home() / '.local' / 'share' / 'fundalytics'))
+WEAVIATE_DATA_PATH = DATA_DIR / 'weaviate'
+IMPORT_PARAMS_FILE = DATA_DIR / 'last_import.json'
+#range filter indexes (indexRangeFilters) need 1.26 or later
+WEAVIATE_VERSION = os.environ.get('FUNDALYTICS_WEAVIATE_VERSION', '1.26.1')
+
+ENERGY_LABELS = ['A++++', 'A+++', 'A++', 'A+', 'A', 'B', 'C', 'D', 'E', 'F', 'G']
+HYBRID_QUERY_PROPERTIES = ['descrip', 'description_summary', 'address']
 
 st.set_page_config(
     page_title='Fundalytics', 
     page_icon=str(Path(__file__).parent / 'icon.png'), 
     layout='wide')
 
+def load_import_params() -> dict | None:
+    try:
+        with open(IMPORT_PARAMS_FILE) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def save_import_params(params: dict, status: str):
+    IMPORT_PARAMS_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with open(IMPORT_PARAMS_FILE, 'w') as f:
+        json.dump(dict(params, status=status), f)
+
 def get_and_set_state(collection_def_file: str):
 
     if 'collection_def' in st.session_state:
@@ -37,93 +88,159 @@ def get_and_set_state(collection_def_file: str):
             collection_def = json.load(f)
         st.session_state['collection_def'] = collection_def
 
-    if 'weaviate_client' in st.session_state:
-        weaviate_client  = st.session_state['weaviate_client']
-    else:
-        weaviate_client = weaviate.WeaviateClient(
-            embedded_options=EmbeddedOptions(
-                additional_env_vars={
-                    "ENABLE_MODULES": "multi2vec-clip,sum-transformers",
-                    "DEFAULT_VECTORIZER_MODULE": "multi2vec-clip",
-                    "CLIP_INFERENCE_API": "http://localhost:8081",
-                    "SUM_INFERENCE_API": "http://localhost:8080",
-                }
-            )
-        )
-        st.session_state['weaviate_client'] = weaviate_client
-
-    if not weaviate_client.is_live():
-        try:
-            weaviate_client.connect()
-            st.session_state['weaviate_client'] = weaviate_client
+    startup_timings = st.session_state.setdefault('startup_timings', {})
 
-        except Exception as e:
-            
-            ### Due to multi-threading in fundascraper and streamlit page refreshes we may need to 
-            ### connect to an existing session.  This is quite a hack
-
-            if isinstance(e, weaviate.exceptions.WeaviateStartUpError) and \
-                "processes are already listening on ports" in e.message:
-
-                existing_port = int([word for word in e.message.split() 
-                                     if word.find('http:') >= 0][0].split(':')[1])
-                existing_grpcport = int([word for word in e.message.split() 
-                                     if word.find('grpc:') >= 0][0].split(':')[1].split('use')[0])
-                
-                weaviate_client = weaviate.connect_to_local(
-                    port=existing_port,
-                    grpc_port=existing_grpcport
-                    )
-                weaviate_client.connect()
-                st.session_state['weaviate_client'] = weaviate_client
-
-            else:
-                raise e
+    #the first session pays for starting Weaviate, later ones only for a liveness check
+    start = time.perf_counter()
+    weaviate_client = get_shared_weaviate().get()
+    startup_timings.setdefault('Weaviate', time.perf_counter() - start)
 
     if 'collection' in st.session_state:
-        collection = st.session_state['collection']
+        #collection handles are tied to the client, which is replaced on reconnect
+        collection = weaviate_client.collections.get(name=collection_def['class']) \
+            if st.session_state['collection'] is not None else None
     else:
+        start = time.perf_counter()
         if weaviate_client.collections.exists(name=collection_def['class']):
+            #reattach to the collection persisted by an earlier run
             collection = weaviate_client.collections.get(name=collection_def['class'])
-            st.session_state['collection'] = collection
+            collection_size = collection.aggregate.over_all(total_count=True).total_count
+            st.session_state['warm_start'] = load_import_params() if collection_size else None
+            startup_timings[f"{collection_def['class']} ({collection_size} listings)"] = time.perf_counter() - start
         else:
             collection = None
+        st.session_state['collection'] = collection
 
     if 'city_list' in st.session_state:
         city_list = st.session_state['city_list']
     else:
+        start = time.perf_counter()
         city_dict = requests.get(CITY_LIST_URL).json()
         city_list = [city['city'].lower() for city in city_dict]
         city_list.sort()
         city_list.insert(0, 'nl')
         st.session_state['city_list'] = city_list
+        startup_timings['City list'] = time.perf_counter() - start
 
     if 'ingest_df' in st.session_state:
         ingest_df = st.session_state['ingest_df']
     else:
         ingest_df = pd.DataFrame()
 
+    #jobs belong to the session which started them.  a page refresh starts a new session,
+    #which finds its import again through the job id kept in the url.
+    if 'ingest_job_id' not in st.session_state:
+        st.session_state['ingest_job_id'] = st.query_params.get('ingest_job')
+
     return collection_def, collection, weaviate_client, city_list, ingest_df
     
-def scrape_and_process_data(scraper: FundaScraper) -> pd.DataFrame:
-
-    download_df = scraper.run(raw_data=False, save=False)
+@st.cache_resource
+def get_shared_weaviate() -> SharedWeaviateClient:
+    return SharedWeaviateClient(
+        embedded_options=EmbeddedOptions(
+            persistence_data_path=str(WEAVIATE_DATA_PATH),
+            version=WEAVIATE_VERSION,
+            additional_env_vars={
+                "ENABLE_MODULES": "multi2vec-clip,sum-transformers",
+                "DEFAULT_VECTORIZER_MODULE": "multi2vec-clip",
+                "CLIP_INFERENCE_API": "http://localhost:8081",
+                "SUM_INFERENCE_API": "http://localhost:8080",
+            }
+        )
+    )
+
+@st.cache_resource
+def get_image_fetcher() -> ImageFetcher:
+    return ImageFetcher()
+
+@st.cache_resource
+def get_image_cache(preprocessed: bool = False) -> ImageCache:
+    return ImageCache(cache_dir=CACHE_DIR / ('images-preprocessed' if preprocessed else 'images'))
+
+@st.cache_resource
+def get_blob_store() -> BlobStore:
+    return BlobStore()
+
+@st.cache_resource
+def get_image_preprocessor() -> ImagePreprocessor:
+    return ImagePreprocessor()
+
+@st.cache_resource
+def get_summary_cache() -> SummaryCache:
+    return SummaryCache()
+
+@st.cache_resource
+def get_summary_filler() -> SummaryFiller:
+    return SummaryFiller()
+
+@st.cache_resource
+def get_job_runner() -> JobRunner:
+    return JobRunner()
+
+@st.cache_resource
+def get_projector() -> Projector:
+    return Projector()
+
+@st.cache_resource
+def get_snapshot_store() -> SnapshotStore:
+    return SnapshotStore()
+
+@st.cache_resource
+def get_clip_client() -> ClipClient:
+    return ClipClient()
+
+@st.cache_resource
+def get_query_embedder() -> QueryEmbedder:
+    return QueryEmbedder(clip_client=get_clip_client(), cache=EmbeddingCache())
+
+def scrape_pages(scraper_args: dict, n_pages: int) -> Iterator[pd.DataFrame]:
+
+    #scrape one page at a time so that each page can be ingested as soon as it lands
+    for page in range(1, n_pages + 1):
+        scraper = FundaScraper(**scraper_args, page_start=page, n_pages=1)
+        download_df = scraper.run(raw_data=False, save=False)
+        if download_df.empty:
+            break
+        yield download_df
+
+def scrape_and_process_data(
+    scraper_args: dict, 
+    n_pages: int,
+    image_fetcher: ImageFetcher,
+    image_cache: ImageCache,
+    image_preprocessor: ImagePreprocessor | None = None) -> Iterator[tuple[pd.DataFrame, dict]]:
+
+    #the next page is scraped while the current one is processed and imported
+    for download_df in prefetch(scrape_pages(scraper_args=scraper_args, n_pages=n_pages)):
+        yield process_listings(
+            download_df=download_df, 
+            image_fetcher=image_fetcher, 
+            image_cache=image_cache,
+            image_preprocessor=image_preprocessor)
+
+def process_listings(
+    download_df: pd.DataFrame,
+    image_fetcher: ImageFetcher,
+    image_cache: ImageCache,
+    image_preprocessor: ImagePreprocessor | None = None) -> tuple[pd.DataFrame, dict]:
 
     if not download_df.empty:
 
         download_df['house_id'] = download_df['house_id'].apply(str)
         download_df.set_index('house_id', inplace=True)
 
-        photos_df = download_df['photo'].apply(lambda x: x.split(',')).explode()
-        photos_df = photos_df.apply(lambda x: x.split()).apply(pd.Series)
-        photos_df = photos_df[photos_df[1] == '180w'].drop(1, axis=1)
+        cover_photos = extract_cover_photos(download_df['photo']).dropna().to_frame('image_url')
 
-        cover_photos = photos_df.groupby('house_id').agg(
-            image_url = (0, lambda x: str(x.tolist()[0]))
-            )
-        cover_photos['image_enc'] = cover_photos['image_url'].apply(
-            lambda x: base64.b64encode(requests.get(x).content).decode('utf-8')
-            )
+        #listings whose cover image could not be downloaded, or was corrupt or a placeholder,
+        #keep its url but are imported without the image itself
+        images, image_failures = fetch_encoded_images(
+            urls=cover_photos['image_url'],
+            fetcher=image_fetcher,
+            cache=image_cache,
+            preprocessor=image_preprocessor)
+
+        cover_photos['image_enc'] = cover_photos['image_url'].map(images)
+        cover_photos['image_hash'] = image_hashes(cover_photos['image_enc'])
         
         ingest_df = download_df.join(cover_photos).drop('photo', axis=1).reset_index()
         
@@ -137,74 +254,654 @@ def scrape_and_process_data(scraper: FundaScraper) -> pd.DataFrame:
         
         #snip overly wordy descriptions
         #sum-tranformers has a 1024 token limit
-        tokenizer = BertTokenizer.from_pretrained("bert-base-cased")
-
-        ingest_df['summary_tokens'] = ingest_df.descrip.apply(tokenizer)
-        ingest_df['descrip'] = ingest_df.summary_tokens.apply(
-            lambda x: tokenizer.decode(x.data['input_ids'][:1024]))
-
-        ingest_df.drop('summary_tokens', axis=1, inplace=True)
+        ingest_df['descrip'] = truncate_descriptions(ingest_df['descrip'])
 
     else:
         ingest_df = download_df
+        image_failures = {}
     
-    return ingest_df
+    return ingest_df, image_failures
+
+def create_collection(
+    weaviate_client: weaviate.WeaviateClient, 
+    collection_def: dict) -> weaviate.collections.Collection:
 
-def import_data(
-    weaviate_client: weaviate.Client, 
-    collection_def: dict,
-    collection: weaviate.collections.Collection | None,
-    ingest_df: pd.DataFrame) -> weaviate.collections.Collection:
-    
     if weaviate_client.collections.exists(name=collection_def['class']):
         weaviate_client.collections.delete(collection_def['class'])
     
-    collection = weaviate_client.collections.create_from_dict(collection_def)
+    DATA_VERSION.bump()
+
+    return weaviate_client.collections.create_from_dict(collection_def)
+
+def insert_objects(
+    collection: weaviate.collections.Collection,
+    ingest_df: pd.DataFrame,
+    vectors: np.ndarray | None = None):
 
+    #an import of unchanged listings leaves the caches keyed on the data version valid
+    if ingest_df.empty:
+        return
+
+    #objects given a vector are not vectorized again by Weaviate
     results = []
     with collection.batch.dynamic() as batch:
-        for data_row in ingest_df.to_dict('records'):
+        for i, data_row in enumerate(ingest_df.to_dict('records')):
             results.append(batch.add_object(
                 uuid=data_row['uuid'],
-                properties=data_row,
+                properties={key: value for key, value in data_row.items() if not pd.isna(value)},
+                vector=vectors[i].tolist() if vectors is not None and vectors[i].any() else None,
             ))
 
     ##TODO: error handling for import results
 
-    return collection
-
-def generate_summary(weaviate_client: weaviate.WeaviateClient, house_id: str) -> str:
-
-    summary_response = weaviate_client.graphql_raw_query(f"""
-            {{
-            Get {{
-                Fundalytics(
-                limit: 1
-                where: {{
-                    path: ["house_id"],
-                    operator: Equal,
-                    valueText: "{house_id}"
-                }}
-                ) {{
-                house_id
-                _additional {{
-                    summary(
-                    properties: ["descrip"],
-                    ) {{
-                    result
-                    }}
-                }}
-                }}
-            }}
-            }}""")
+    #every inserted object is (re-)vectorized, here or by Weaviate, so vectors change too
+    DATA_VERSION.bump()
+
+def get_existing_objects(
+    collection: weaviate.collections.Collection) -> dict:
+
+    return {
+        str(obj.uuid): obj.properties for obj in collection.iterator(
+            return_properties=[
+                'content_hash', 'properties_hash', 'description_summary', 'linked_image', 'image_key', 'image_hash'])
+        }
+
+def import_data(
+    collection_def: dict,
+    collection: weaviate.collections.Collection,
+    ingest_df: pd.DataFrame,
+    existing_objects: dict,
+    clip_client: ClipClient | None = None,
+    store_images: bool = True,
+    blob_store: BlobStore | None = None,
+    progress=None) -> tuple[pd.DataFrame, dict]:
+
+    if not store_images and clip_client is None:
+        raise ValueError("Images can only be kept out of Weaviate when listings are vectorized in the app.")
+
+    #a photo which failed to download this time is restored from the blob store, so the
+    #listing keeps its image and is not re-vectorized without it
+    if blob_store is not None and 'image_enc' in ingest_df:
+        stored_keys = ingest_df['uuid'].map(lambda x: existing_objects.get(x, {}).get('image_key'))
+        restore = ingest_df['image_enc'].isna() & stored_keys.notna()
+        if restore.any():
+            restored = stored_keys[restore].map(blob_store.get).map(
+                lambda x: base64.b64encode(x).decode('utf-8') if x is not None else None)
+            ingest_df.loc[restore, 'image_enc'] = restored
+            ingest_df.loc[restore, 'image_hash'] = image_hashes(restored)
+
+    #listings whose description, image and metadata are unchanged since the last import 
+    #are neither re-vectorized nor re-summarized
+    ingest_df['content_hash'] = content_hashes(ingest_df, collection_def)
+    stored = ingest_df['uuid'].map(lambda x: existing_objects.get(x, {}))
+    is_new = stored.map(len) == 0
+
+    #an existing listing whose photo failed to download is compared on its text alone and,
+    #if that is unchanged, keeps its stored object and image in every storage mode
+    stored_hash = stored.map(lambda x: x.get('content_hash'))
+    image_failed = ingest_df['image_url'].notna() & \
+        (ingest_df['image_enc'].isna() if 'image_enc' in ingest_df else True)
+    keep_image = image_failed & ~is_new & \
+        (ingest_df['content_hash'].str.split(':').str[0] == stored_hash.str.split(':').str[0])
+    if keep_image.any():
+        ingest_df.loc[keep_image, 'content_hash'] = stored_hash[keep_image]
+        ingest_df.loc[keep_image, 'image_hash'] = stored[keep_image].map(lambda x: x.get('image_hash'))
+
+    ingest_df['properties_hash'] = hash_rows(ingest_df, metadata_properties(collection_def))
+
+    is_same_content = ingest_df['content_hash'] == stored.map(lambda x: x.get('content_hash'))
+    is_unchanged = is_same_content & \
+        (ingest_df['properties_hash'] == stored.map(lambda x: x.get('properties_hash')))
+
+    for column in ['description_summary', 'linked_image', 'image_key']:
+        ingest_df[column] = stored.map(lambda x: x.get(column)).where(is_same_content)
+
+    #new listings are linked without a summary, which is patched in once generated
+    if (~is_same_content).any():
+        ingest_df.loc[~is_same_content, 'linked_image'] = format_linked_images(ingest_df[~is_same_content])
+
+    #with a clip client objects are vectorized here in large concurrent batches rather than
+    #one at a time by Weaviate's multi2vec-clip module
+    insert_df = ingest_df[~is_same_content]
+    insert_vectors = vectorize_objects(
+        clip_client=clip_client,
+        df=insert_df,
+        collection_def=collection_def,
+        progress=progress) if clip_client is not None else None
+
+    #once vectorized, images can be left out of the objects or replaced by a blob store key
+    if not store_images and 'image_enc' in insert_df:
+        if blob_store is not None:
+            ingest_df.loc[~is_same_content, 'image_key'] = insert_df['image_enc'].map(
+                lambda x: blob_store.put(base64.b64decode(x)) if isinstance(x, str) else None)
+            insert_df = ingest_df[~is_same_content]
+        #rows the app could not vectorize keep their image for Weaviate to vectorize
+        insert_df = insert_df.assign(image_enc=insert_df['image_enc'].where(~insert_vectors.any(axis=1)))
+
+    insert_objects(collection=collection, ingest_df=insert_df, vectors=insert_vectors)
+
+    #metadata-only changes (ie. price) are patched without re-vectorizing
+    update_properties(
+        collection=collection,
+        collection_def=collection_def,
+        update_df=ingest_df[is_same_content & ~is_unchanged],
+        columns=metadata_properties(collection_def) + ['properties_hash'])
+
+    import_counts = {
+        'new': int(is_new.sum()),
+        'changed': int((~is_new & ~is_unchanged).sum()),
+        'unchanged': int(is_unchanged.sum()),
+        'vectorized by Weaviate': int((~insert_vectors.any(axis=1)).sum()) if insert_vectors is not None else 0,
+        }
+
+    #images are only needed for vectorization
+    return ingest_df.drop(columns='image_enc', errors='ignore'), import_counts
+
+def delete_vanished_objects(
+    collection: weaviate.collections.Collection,
+    existing_objects: dict,
+    keep_uuids: set) -> int:
+
+    vanished = [uuid for uuid in existing_objects if uuid not in keep_uuids]
+
+    for i in range(0, len(vanished), 1000):
+        collection.data.delete_many(where=Filter.by_id().contains_any(vanished[i:i + 1000]))
+
+    if vanished:
+        DATA_VERSION.bump()
+
+    return len(vanished)
+
+def city_filter(city_name: str):
+
+    if city_name.lower() == 'nl':
+        return None
+    else:
+        return Filter.by_property('city').equal(city_name)
+
+def listing_filter(city_name: str, ranges: dict | None = None, energy_labels: list | None = None):
+    """
+    Returns the Weaviate filter for a city, {property: (min, max)} ranges, where either
+    bound may be None, and a list of accepted energy labels.
+    """
+
+    filters = [city_filter(city_name)]
+
+    for name, (low, high) in (ranges or {}).items():
+        if low is not None:
+            filters.append(Filter.by_property(name).greater_or_equal(low))
+        if high is not None:
+            filters.append(Filter.by_property(name).less_or_equal(high))
+    
+    #energy_label is field tokenized so labels compare whole, 'A+' does not match 'A'
+    if energy_labels:
+        filters.append(reduce(operator.or_, [Filter.by_property('energy_label').equal(label) for label in energy_labels]))
+
+    filters = [f for f in filters if f is not None]
+
+    return reduce(operator.and_, filters) if filters else None
+
+def listing_mask(listing_df: pd.DataFrame, ranges: dict | None = None, energy_labels: list | None = None) -> pd.Series:
+    """
+    Applies the listing_filter ranges and energy labels to rows already held locally.
+    """
+
+    mask = pd.Series(True, index=listing_df.index)
+
+    for name, (low, high) in (ranges or {}).items():
+        if low is not None:
+            mask &= listing_df[name] >= low
+        if high is not None:
+            mask &= listing_df[name] <= high
+    
+    if energy_labels:
+        mask &= listing_df['energy_label'].isin(energy_labels)
+
+    return mask
+
+#query results are cached across reruns until the collection changes
+@st.cache_data(max_entries=8, show_spinner=False)
+def fetch_listing_df(
+    _collection: weaviate.collections.Collection, 
+    data_version: str, 
+    city_name: str,
+    return_properties: list) -> pd.DataFrame:
+
+    return fetch_dataframe(
+        collection=_collection,
+        return_properties=return_properties,
+        city_name=city_name)
+
+@st.cache_data(max_entries=8, show_spinner="Projecting vectors to 3D...")
+def project_vectors(
+    vector_version: str,
+    city_name: str,
+    method: str,
+    _house_ids: list,
+    _vectors: np.ndarray) -> np.ndarray:
+
+    return get_projector().project(key=city_name, ids=_house_ids, vectors=_vectors, method=method)
+
+@st.cache_data(max_entries=8, show_spinner="Looking for duplicate listings...")
+def find_duplicate_listings(
+    _collection: weaviate.collections.Collection,
+    vector_version: str,
+    data_version: str,
+    city_name: str,
+    threshold: float,
+    display_columns: list) -> pd.DataFrame:
+
+    index_df, vectors = get_snapshot_store().get(collection=_collection, version=vector_version).select(city_name)
+
+    listing_df = fetch_listing_df(
+        _collection=_collection,
+        data_version=data_version,
+        city_name=city_name,
+        return_properties=list(dict.fromkeys(['house_id', 'image_hash', 'zip'] + display_columns)))
+    
+    return find_duplicates(
+        index=index_df[['house_id']].merge(listing_df, on='house_id', how='left'),
+        vectors=vectors,
+        threshold=threshold)
+
+def search_response_df(search_objects: list, metric: str = 'distance') -> pd.DataFrame:
+
+    _ = [obj.properties.update({'similarity': getattr(obj.metadata, metric)}) for obj in search_objects]
+
+    search_display_list = []
+    _ = [search_display_list.append(obj.properties) for obj in search_objects]
+
+    return pd.DataFrame(search_display_list)
+
+def show_search_results(search_df: pd.DataFrame):
+
+    if search_df.empty:
+        st.write('No properties found for the given search criteria')
+    else:
+        search_df = search_df.set_index('linked_image')
+        search_df.index.name = ''
+
+        st.markdown(
+            search_df.to_html(
+                escape=False,
+                border=0), 
+            unsafe_allow_html=True
+            )
+
+def similar_listings(
+    collection: weaviate.collections.Collection,
+    house_id: str,
+    city_name: str,
+    display_columns: list,
+    limit: int = 5) -> pd.DataFrame:
+    """
+    Searches with the listing's stored vector, so nothing is downloaded or vectorized.
+    """
+
+    search_response = collection.query.near_object(
+        near_object=generate_uuid5(house_id),
+        filters=city_filter(city_name),
+        return_properties=display_columns,
+        limit=limit + 1,
+        return_metadata=MetadataQuery(distance=True)
+        )
+    
+    #the listing itself is always its own nearest neighbour
+    search_objects = [obj for obj in search_response.objects if str(obj.uuid) != generate_uuid5(house_id)]
+
+    return search_response_df(search_objects[:limit])
+
+def load_search_image(url: str) -> str:
+
+    search_images, search_failures = fetch_encoded_images(
+        urls=[url],
+        fetcher=get_image_fetcher(),
+        cache=get_image_cache())
     
-    return summary_response.get[collection_def['class']][0]['_additional']['summary'][0]['result']
+    if url not in search_images:
+        st.error(f"Unable to download the search image. {search_failures.get(url, '')}")
+        st.stop()
+
+    return search_images[url]
+
+def local_search(
+    collection: weaviate.collections.Collection,
+    search_vector: list,
+    city_name: str,
+    display_columns: list,
+    limit: int = 5,
+    exclude: list | None = None,
+    ranges: dict | None = None,
+    energy_labels: list | None = None) -> pd.DataFrame:
+
+    #display properties come from the cached listing query rather than another round-trip
+    listing_df = fetch_listing_df(
+        _collection=collection,
+        data_version=DATA_VERSION.data,
+        city_name='nl',
+        return_properties=list(dict.fromkeys(['house_id', 'energy_label'] + list(ranges or {}) + display_columns)))
+
+    local_index = get_snapshot_store().get_index(collection=collection, version=DATA_VERSION.vectors)
+
+    search_df = local_index.search(
+        query_vector=search_vector, 
+        k=limit, 
+        city_name=city_name, 
+        exclude=exclude,
+        include=listing_df.loc[listing_mask(listing_df, ranges, energy_labels), 'house_id'].tolist() \
+            if ranges or energy_labels else None)
+
+    return search_df[['house_id', 'distance']].merge(listing_df, on='house_id', how='inner') \
+        .rename(columns={'distance': 'similarity'})[display_columns + ['similarity']]
+
+def summarize_listings(
+    weaviate_client: weaviate.WeaviateClient,
+    collection: weaviate.collections.Collection,
+    collection_def: dict,
+    summary_cache: SummaryCache,
+    summary_df: pd.DataFrame,
+    generate: bool = True,
+    progress=None) -> tuple[pd.DataFrame, dict]:
+
+    #cached summaries are always applied, the rest are only generated if requested
+    summary_df = summary_df.copy()
+    summary_df['description_summary'] = summary_cache.get_many(summary_df['descrip'])
+
+    needs_summary = summary_df['description_summary'].isna()
+    summary_failures = {}
+
+    if generate and needs_summary.any():
+
+        summaries, summary_failures = generate_summaries(
+            weaviate_client=weaviate_client,
+            class_name=collection_def['class'],
+            house_ids=summary_df.loc[needs_summary, 'house_id'].tolist(),
+            progress=progress)
+        
+        summary_df.loc[needs_summary, 'description_summary'] = \
+            summary_df.loc[needs_summary, 'house_id'].map(summaries)
+        summary_cache.put_many(
+            descriptions=summary_df.loc[needs_summary, 'descrip'],
+            summaries=summary_df.loc[needs_summary, 'description_summary'])
+
+    if not summary_df.empty:
     
+        summary_df['linked_image'] = format_linked_images(summary_df)
+
+        #when summaries are left to the filler only listings with a cached summary change now
+        summary_failures.update(update_properties(
+            collection=collection,
+            collection_def=collection_def,
+            update_df=summary_df if generate else summary_df[summary_df['description_summary'].notna()],
+            columns=['description_summary', 'linked_image']))
+
+    return summary_df, summary_failures
+
+def format_linked_images(ingest_df: pd.DataFrame) -> pd.Series:
+
+    #listings without a cover photo get no link rather than a broken image
+    return ingest_df.apply(
+        lambda x: '<a href="{house_url}" target="_blank" title="{description_summary}"><img src="{image_url}" width="60" ></a>'.format(
+            image_url=x.image_url,
+            house_url=x.url,
+            description_summary=x.description_summary if isinstance(x.description_summary, str) else '') \
+            if isinstance(x.image_url, str) else '',
+        axis=1
+        )
+
+def ingest_rows(job: Job) -> pd.DataFrame:
+
+    ingest_pages = list(job.result.get('ingest_pages', []))
+
+    return pd.concat(ingest_pages, ignore_index=True) if ingest_pages else pd.DataFrame()
+
+def run_ingest(
+    job: Job,
+    shared_weaviate: SharedWeaviateClient,
+    collection_def: dict,
+    scraper_args: dict,
+    n_pages: int,
+    incremental_import: bool,
+    lazy_summaries: bool,
+    collapse_duplicate_listings: bool,
+    clip_client: ClipClient | None,
+    store_images: bool,
+    blob_store: BlobStore | None,
+    image_fetcher: ImageFetcher,
+    image_cache: ImageCache,
+    image_preprocessor: ImagePreprocessor | None,
+    summary_cache: SummaryCache,
+    summary_filler: SummaryFiller):
+
+    ##runs in a background thread so must not call streamlit
+
+    #the shared client may reconnect while the job runs, so client and collection
+    #handles are looked up on every use rather than held
+    def get_collection() -> weaviate.collections.Collection:
+        return shared_weaviate.get().collections.get(name=collection_def['class'])
+
+    #pages are concatenated once at the end, the UI reads the list as it grows
+    ingest_pages = []
+    seen_df = pd.DataFrame(columns=['house_id', 'image_hash', 'descrip'])
+    import_counts = {'new': 0, 'changed': 0, 'unchanged': 0}
+    if clip_client is not None:
+        import_counts['vectorized by Weaviate'] = 0
+    collapsed_count = 0
+    job.result.update(ingest_pages=ingest_pages, image_failures={})
+
+    has_collection = incremental_import and shared_weaviate.get().collections.exists(name=collection_def['class'])
+
+    #a collection created with other index or tokenization settings is recreated, as
+    #those cannot be changed in place
+    if has_collection:
+        changed_properties = schema_differences(shared_weaviate.schema(collection_def['class']), collection_def)
+        if changed_properties:
+            job.log(f"Collection settings changed for {', '.join(changed_properties)}, re-importing all listings.")
+            has_collection = False
+
+    existing_objects = get_existing_objects(collection=get_collection()) if has_collection else {}
+
+    if image_preprocessor is not None:
+        bytes_in, bytes_out = image_preprocessor.bytes_in, image_preprocessor.bytes_out
+        processed, dropped = image_preprocessor.processed, image_preprocessor.dropped
+
+    job.stage('pages', total=n_pages)
+    job.stage('listings')
+    if clip_client is not None:
+        job.stage('vectors')
+
+    import_started = False
+
+    #vectorize_objects reports progress within a page, the stage counts across pages
+    page_vectors = 0
+
+    def show_vector_progress(done: int, total: int):
+        nonlocal page_vectors
+        job.advance('vectors', done - page_vectors)
+        page_vectors = done if done < total else 0
+        job.check_cancelled()
+
+    for page_df, page_failures in scrape_and_process_data(
+        scraper_args=scraper_args, 
+        n_pages=n_pages,
+        image_fetcher=image_fetcher,
+        image_cache=image_cache,
+        image_preprocessor=image_preprocessor):
+
+        job.check_cancelled()
+        job.advance('pages')
+        job.result['image_failures'].update(page_failures)
+
+        if collapse_duplicate_listings and not page_df.empty:
+            #rows repeating a listing from this or an earlier page are dropped
+            kept_df, _ = collapse_duplicates(
+                pd.concat([seen_df, page_df[seen_df.columns]]).drop_duplicates(subset='house_id'))
+            seen_df = kept_df[seen_df.columns]
+            n_listings = len(page_df)
+            page_df = page_df[page_df['house_id'].isin(kept_df['house_id'])]
+            collapsed_count += n_listings - len(page_df)
+
+        if page_df.empty:
+            continue
+
+        #recorded before the collection changes, so a failed or cancelled import is not
+        #mistaken for the previous, complete one on the next warm start
+        if not import_started:
+            save_import_params(job.params, status='in progress')
+            import_started = True
+
+        if not has_collection:
+            create_collection(
+                weaviate_client=shared_weaviate.get(),
+                collection_def=collection_def)
+            has_collection = True
+
+        page_df, page_counts = import_data(
+            collection_def=collection_def,
+            collection=get_collection(),
+            ingest_df=page_df,
+            existing_objects=existing_objects,
+            clip_client=clip_client,
+            store_images=store_images,
+            blob_store=blob_store,
+            progress=show_vector_progress)
+
+        import_counts = {key: import_counts[key] + page_counts[key] for key in import_counts}
+        ingest_pages.append(page_df)
+        
+        job.advance('listings', len(page_df))
+        job.result.update(collection=collection_def['class'])
+
+    job.finish_stage('pages')
+    job.finish_stage('listings')
+    job.finish_stage('vectors')
+
+    ingest_df = ingest_rows(job)
+    if ingest_df.empty:
+        job.log('No properties imported.  Try relaxing the search constraints.')
+        job.result['ingest_df'] = ingest_df
+        return
+
+    import_counts['deleted'] = delete_vanished_objects(
+        collection=get_collection(),
+        existing_objects=existing_objects,
+        keep_uuids=set(ingest_df['uuid']))
+    if blob_store is not None:
+        #the collection now holds exactly the imported listings, so other blobs are unreferenced
+        import_counts['blobs deleted'] = blob_store.retain(set(ingest_df['image_key'].dropna()))
+    job.log(', '.join(f"{count} {key}" for key, count in import_counts.items()))
+    if collapse_duplicate_listings:
+        job.log(f"{collapsed_count} duplicate listings collapsed.")
+    if image_preprocessor is not None:
+        bytes_in, bytes_out = image_preprocessor.bytes_in - bytes_in, image_preprocessor.bytes_out - bytes_out
+        job.log(
+            f"Images: {image_preprocessor.processed - processed} preprocessed, "
+            f"{image_preprocessor.dropped - dropped} corrupt or placeholder images dropped, "
+            f"{bytes_in / 1024:.0f} KB downloaded, {bytes_out / 1024:.0f} KB imported "
+            f"({1 - bytes_out / bytes_in if bytes_in else 0:.0%} smaller).")
+
+    cache_hits, cache_misses = summary_cache.hits, summary_cache.misses
+    job.stage('summaries')
+
+    def show_summary_progress(done: int, total: int):
+        job.update('summaries', done=done, total=total)
+        job.check_cancelled()
+
+    summary_df, summary_failures = summarize_listings(
+        weaviate_client=shared_weaviate.get(),
+        collection=get_collection(),
+        collection_def=collection_def,
+        summary_cache=summary_cache,
+        summary_df=ingest_df[ingest_df['description_summary'].isna()],
+        generate=not lazy_summaries,
+        progress=show_summary_progress)
+
+    job.finish_stage('summaries')
+
+    if summary_failures:
+        job.log(f"⚠️ Summaries could not be generated for {len(summary_failures)} properties.")
+
+    if not summary_df.empty:
+        ingest_df.update(summary_df[['description_summary', 'linked_image']])
+
+    #remaining summaries are generated in the background, visible rows first
+    summary_rows = summary_df.set_index('house_id')
+
+    def summarize_pending(house_ids: list) -> dict:
+        pending_df, _ = summarize_listings(
+            weaviate_client=shared_weaviate.get(),
+            collection=get_collection(),
+            collection_def=collection_def,
+            summary_cache=summary_cache,
+            summary_df=summary_rows.loc[house_ids].reset_index())
+        return pending_df.set_index('house_id')['description_summary'].dropna().to_dict()
+
+    summary_filler.start(
+        handler=summarize_pending,
+        house_ids=summary_df.loc[summary_df['description_summary'].isna(), 'house_id'].tolist() \
+            if lazy_summaries else [])
+
+    job.log(
+        f"Summary cache: {summary_cache.hits - cache_hits} hits, "
+        f"{summary_cache.misses - cache_misses} misses "
+        f"({summary_cache.hits} hits, {summary_cache.misses} misses since start, "
+        f"{len(summary_cache)} stored)")
+
+    job.result.update(ingest_df=ingest_df, collection=collection_def['class'])
+    save_import_params(job.params, status='completed')
+
+def show_ingest_progress(job: Job):
+
+    if job.running:
+        st.write(f"Importing {job.params['property_type']}s to {job.params['want_to']} in {job.params['area']}... please wait")
+        for stage in job.progress():
+            text = f"{stage['name']}: {stage['done']}" + \
+                (f" of {stage['total']}" if stage['total'] else '') + \
+                f" ({stage['rate']:.1f}/s)"
+            if stage['total']:
+                st.progress(min(1.0, stage['done'] / stage['total']), text=text)
+            else:
+                st.caption(text)
+        st.button(label='Cancel import', on_click=job.cancel, disabled=job.cancelled)
+    elif job.status == 'completed':
+        st.write('Import completed')
+    elif job.status == 'cancelled':
+        st.write('Import cancelled')
+    else:
+        st.error(f"Import failed. {job.error}")
+
+    for message in job.messages:
+        st.caption(message)
+
+    image_failures = job.result.get('image_failures', {})
+    if image_failures and not job.running:
+        with st.expander(f"⚠️ {len(image_failures)} cover images could not be downloaded"):
+            st.write(image_failures)
+
+    #rerun the whole page once the job has finished to show its results
+    if st.session_state.get('ingest_job_status') != (job.id, job.status):
+        st.session_state['ingest_job_status'] = (job.id, job.status)
+        if not job.running:
+            st.rerun()
+
+def show_ingest_rows(job: Job):
+
+    ingest_pages = list(job.result.get('ingest_pages', []))
+    if not ingest_pages:
+        st.write('Scraping Data... please wait')
+    else:
+        st.dataframe(
+            pd.concat([page_df[listing_display_columns] for page_df in ingest_pages], ignore_index=True),
+            hide_index=True)
+
 def reset_search():
     st.session_state.search_input = ''
 
 def reset_ingest():
     st.session_state.ingest_df = pd.DataFrame()
+    st.session_state.ingest_job_id = None
+    st.query_params.pop('ingest_job', None)
+    st.session_state.warm_start = None
     ingest_df = pd.DataFrame()
 
 collection_def, collection, weaviate_client, city_list, ingest_df = get_and_set_state(COLLECTION_DEF_FILE)
@@ -241,6 +938,32 @@ with st.container():
     with logo_col:
         st.image(header_image) 
 
+listing_tab, threedviewer_tab, image_search_tab = st.tabs(
+    ['Data Viewer', '3D Viewer', 'Multi-Modal Search']
+)
+
+listing_display_columns=[
+    'address', 
+    'city',
+    'living_area', 
+    'price', 
+    'price_m2', 
+    'bedroom', 
+    'bathroom', 
+    'energy_label',
+    ]
+
+search_display_columns = [
+    'linked_image',
+    'address', 
+    'city',
+    'living_area', 
+    'price', 
+    'price_m2', 
+    'bedroom', 
+    'bathroom', 
+    'energy_label']
+
 with st.sidebar:
 
     city_name = st.selectbox(
@@ -293,119 +1016,179 @@ with st.sidebar:
             on_change=reset_ingest,
             ) 
     
+    incremental_import = st.checkbox(
+            label="Incremental import",
+            value=True,
+            help="Only re-vectorize and re-summarize listings which are new or changed since the last import.",
+            )
+    
+    lazy_summaries = st.checkbox(
+            label="Summarize lazily",
+            value=False,
+            help="Generate summaries in the background, starting with the listings on screen, instead of before the import completes.",
+            )
+    
+    collapse_duplicate_listings = st.checkbox(
+            label="Collapse duplicates",
+            value=False,
+            help="Import only the first of listings sharing a description and a near-identical cover photo.",
+            )
+    
+    image_storage = st.selectbox(
+            label="Image storage",
+            options=['Weaviate', 'Local blob store', 'None'],
+            help="Where cover photos are kept once vectorized.  Keeping them out of Weaviate shrinks its objects and memory, and requires vectorizing in the app.",
+            )
+    
+    vectorize_in_app = st.checkbox(
+            label="Vectorize in the app",
+            value=image_storage != 'Weaviate',
+            disabled=image_storage != 'Weaviate',
+            help="Send listings to the CLIP service in large concurrent batches and import them with their vectors, instead of letting Weaviate vectorize them one at a time.",
+            )
+    
+    preprocess_images = st.checkbox(
+            label="Preprocess images",
+            value=True,
+            help="Shrink cover photos to CLIP's 224px input and drop corrupt or placeholder images before import.",
+            )
+    
     st.write("** required fields")
     
+    ingest_job = get_job_runner().get(st.session_state.get('ingest_job_id'))
+
+    #all sessions share one collection, so only one import may run at a time
+    running_job = get_job_runner().running('ingest')
+    if running_job is not None and running_job is not ingest_job:
+        st.caption(
+            f"⏳ Another session is importing {running_job.params['property_type']}s to "
+            f"{running_job.params['want_to']} in {running_job.params['area']}. "
+            "Import is disabled until it finishes.")
+
     if city_name and want_to and property_type:
         
-        if st.button(label="Import Data"):
-
-            status_message = st.empty()
+        if st.button(
+            label="Import Data", 
+            disabled=running_job is not None):
             
             ##DEBUG: city_name='nl'; want_to='buy'; property_type='house'; max_pages=1; min_price=10000000; max_price=min_sqm=days_since=None
 
-            scraper = FundaScraper(
+            scraper_args = dict(
                 area=city_name, 
                 want_to=want_to, 
                 property_type=property_type,
                 days_since=days_since,
                 min_price=min_price,
                 max_price=max_price,
-                find_past=False, 
-                page_start=1, 
-                n_pages=max_pages)
-
-            status_message.write('Scraping Data... please wait')
-
-            ingest_df = scrape_and_process_data(scraper=scraper)
-
-            st.session_state['ingest_df'] = ingest_df
-
-            status_message.write('Importing data to Weaviate Embedded instance... please wait')
-
-            if not ingest_df.empty:
-                collection = import_data(
-                    weaviate_client=weaviate_client,
-                    collection_def=collection_def,
-                    collection=collection,
-                    ingest_df=ingest_df)
-                
-                status_message.write('Generating summaries')
-
-                ingest_df['description_summary'] = ingest_df.house_id.apply(
-                    lambda x: generate_summary(
-                        weaviate_client=weaviate_client,
-                        house_id=x))
-                
-                ingest_df['linked_image'] = ingest_df.apply(
-                    lambda x: '<a href="{house_url}" target="_blank" title="{description_summary}"><img src="{image_url}" width="60" ></a>'.format(
-                        image_url=x.image_url,
-                        house_url=x.url,
-                        description_summary=x.description_summary),
-                    axis=1
-                    )
-                
-                collection = import_data(
-                    weaviate_client=weaviate_client,
-                    collection_def=collection_def,
-                    collection=collection,
-                    ingest_df=ingest_df)
-
-                status_message.write('Import completed')
-            else:
-                status_message.write('No properties imported.  Try relaxing the search constraints.')
+                find_past=False)
+
+            ingest_job = get_job_runner().submit(
+                name='ingest',
+                target=run_ingest,
+                params=scraper_args,
+                shared_weaviate=get_shared_weaviate(),
+                collection_def=collection_def,
+                scraper_args=scraper_args,
+                n_pages=max_pages,
+                incremental_import=incremental_import,
+                lazy_summaries=lazy_summaries,
+                collapse_duplicate_listings=collapse_duplicate_listings,
+                clip_client=get_clip_client() if vectorize_in_app or image_storage != 'Weaviate' else None,
+                store_images=image_storage == 'Weaviate',
+                blob_store=get_blob_store() if image_storage == 'Local blob store' else None,
+                image_fetcher=get_image_fetcher(),
+                image_cache=get_image_cache(preprocessed=preprocess_images),
+                image_preprocessor=get_image_preprocessor() if preprocess_images else None,
+                summary_cache=get_summary_cache(),
+                summary_filler=get_summary_filler())
             
-            st.session_state['collection'] = collection
+            st.session_state['ingest_job_id'] = ingest_job.id
+            st.query_params['ingest_job'] = ingest_job.id
 
-listing_tab, threedviewer_tab, image_search_tab = st.tabs(
-    ['Data Viewer', '3D Viewer', 'Multi-Modal Search']
-)
+    if ingest_job is not None:
+        if ingest_job.running:
+            st.experimental_fragment(run_every=1)(show_ingest_progress)(ingest_job)
+        else:
+            show_ingest_progress(ingest_job)
+
+    startup_timings = st.session_state.get('startup_timings', {})
+    if startup_timings:
+        with st.expander(f"Started in {sum(startup_timings.values()):.1f} s"):
+            for name, seconds in startup_timings.items():
+                st.caption(f"{name}: {seconds:.2f} s")
+
+#results of the session's ingest job, which may have been started before a page refresh.
+#a cancelled or failed job leaves the listings imported before it stopped.
+if ingest_job is not None and not ingest_job.running and 'ingest_pages' in ingest_job.result:
+    ingest_df = ingest_job.result['ingest_df'] if 'ingest_df' in ingest_job.result else ingest_rows(ingest_job)
+    collection = weaviate_client.collections.get(name=collection_def['class']) \
+        if 'collection' in ingest_job.result else collection
+    city_name = ingest_job.params['area']
+    want_to = ingest_job.params['want_to']
+    property_type = ingest_job.params['property_type']
+
+#otherwise a restarted app shows the import persisted by the embedded instance
+elif ingest_job is None and st.session_state.get('warm_start') and collection is not None:
+    city_name = st.session_state['warm_start']['area']
+    want_to = st.session_state['warm_start']['want_to']
+    property_type = st.session_state['warm_start']['property_type']
+    if st.session_state['warm_start'].get('status', 'completed') != 'completed':
+        st.warning(
+            f"The last import ({property_type}s to {want_to} in {city_name}) did not complete, "
+            "so the collection may hold only part of it or listings of an earlier import. "
+            "Import again to refresh it.")
+    ingest_df = fetch_listing_df(
+        _collection=collection,
+        data_version=DATA_VERSION.data,
+        city_name=city_name,
+        return_properties=['house_id'])
 
 with listing_tab:
     
     st.header('Data Viewer')
 
-    if ingest_df.empty:
+    if ingest_job is not None and ingest_job.running:
+
+        st.experimental_fragment(run_every=2)(show_ingest_rows)(ingest_job)
+
+    elif ingest_df.empty:
         
         st.write("⚠️ Select at least a city, transaction type and property type in the side bar.")
     
     else:
 
         st.write(f"Summary for {property_type}s to {want_to} in {city_name}.")
-
-        listing_display_columns=[
-            'address', 
-            'city',
-            'living_area', 
-            'price', 
-            'price_m2', 
-            'bedroom', 
-            'bathroom', 
-            'energy_label',
-            ]
         
-        if city_name.lower() == 'nl':
-            listing_filters = None
-        else:
-            listing_filters = (
-                    Filter.by_property('city').equal(city_name)
-                    )
-
-        listing_response = collection.query.fetch_objects(
-            include_vector=False, 
-            filters=listing_filters,
-            return_properties=['linked_image'] + listing_display_columns,
-            limit=10000,
+        listing_df = fetch_listing_df(
+            _collection=collection,
+            data_version=DATA_VERSION.data,
+            city_name=city_name,
+            return_properties=['house_id', 'description_summary', 'linked_image'] + listing_display_columns,
             )
-
-        listing_data_list = []
-        _ = [listing_data_list.append(obj.properties) for obj in listing_response.objects]
-
-        listing_df = pd.DataFrame(listing_data_list) #.set_index('linked_image')
-        # listing_df.index.name = ''
         
         if listing_df.empty:
             st.write('No properties found for the given search criteria')
         else:
+            page_size_col, page_col, _ = st.columns([1, 1, 4])
+            with page_size_col:
+                listing_page_size = st.selectbox(label='Rows per page', options=LISTING_PAGE_SIZES, index=1)
+            with page_col:
+                listing_page = st.number_input(
+                    label='Page', 
+                    min_value=1, 
+                    max_value=max(1, -(-len(listing_df) // listing_page_size)),
+                    value=1)
+            
+            listing_df = listing_df.iloc[(listing_page - 1) * listing_page_size:listing_page * listing_page_size]
+
+            summary_filler = get_summary_filler()
+            if summary_filler.pending:
+                summary_filler.prioritize(
+                    listing_df.loc[listing_df.get('description_summary', pd.Series(index=listing_df.index)).isna(), 
+                                   'house_id'].tolist())
+                st.caption(f"⏳ {summary_filler.pending} summaries are still being generated.")
+                st.button(label='Refresh summaries')
+
             # st.markdown(
             #     listing_df[listing_display_columns].to_html(
             #         escape=False,
@@ -433,17 +1216,61 @@ with listing_tab:
                     """),
                 width=100)
             
+            gb.configure_selection(selection_mode='single')
+            
             gb.configure_grid_options(
                 rowHeight=40,
                 suppressColumnVirtualisation=True
                 )
 
-            AgGrid(
+            listing_grid = AgGrid(
                 data=listing_df,
                 gridOptions=gb.build(),
                 columns_auto_size_mode=ColumnsAutoSizeMode.FIT_CONTENTS,
-                allow_unsafe_jscode=True
+                allow_unsafe_jscode=True,
+                update_on=['selectionChanged'],
                 )
+            
+            selected_rows = listing_grid.selected_rows
+            if selected_rows is None or selected_rows.empty:
+                st.caption('Select a listing to find similar listings.')
+            else:
+                selected_row = selected_rows.iloc[0]
+                st.write(f"Listings similar to {selected_row['address']}:")
+                show_search_results(
+                    similar_listings(
+                        collection=collection,
+                        house_id=selected_row['house_id'],
+                        city_name=city_name,
+                        display_columns=search_display_columns))
+            
+            with st.expander('Duplicate listings'):
+                
+                duplicate_threshold = st.slider(
+                    label='Minimum similarity',
+                    min_value=0.9,
+                    max_value=1.0,
+                    value=DEDUP_SIMILARITY,
+                    step=0.005,
+                    help='Listings are grouped when their vectors are at least this similar or their cover photos are near-identical.')
+                
+                duplicates_df = find_duplicate_listings(
+                    _collection=collection,
+                    vector_version=DATA_VERSION.vectors,
+                    data_version=DATA_VERSION.data,
+                    city_name=city_name,
+                    threshold=duplicate_threshold,
+                    display_columns=['url'] + listing_display_columns)
+                
+                if duplicates_df.empty:
+                    st.write('No duplicate listings found.')
+                else:
+                    st.caption(
+                        f"{duplicates_df['cluster'].nunique()} groups covering {len(duplicates_df)} listings.")
+                    st.dataframe(
+                        duplicates_df[['cluster', 'size', 'url'] + listing_display_columns],
+                        hide_index=True,
+                        column_config={'url': st.column_config.LinkColumn()})
                     
 with threedviewer_tab:
     st.header('3D Viewer')
@@ -456,42 +1283,27 @@ with threedviewer_tab:
 
         st.write(f"3D visualization for embedded {property_type}s to {want_to} in {city_name}.")
 
-        threed_display_columns = ['house_id', 'url','price']
-                        
-        if city_name.lower() == 'nl':
-            threed_filters = None
-        else:
-            threed_filters = (
-                    Filter.by_property('city').equal(city_name)
-                    )
-
-        threed_response = collection.query.fetch_objects(
-            include_vector=True, 
-            filters=threed_filters,
-            return_properties=threed_display_columns,
-            limit=10000
-            )
-        
-        len(threed_response.objects)
-                    
-        _ = [obj.properties.update({'vector': obj.vector['default']}) for obj in threed_response.objects]
+        with st.spinner('Exporting vectors...'):
+            vector_snapshot = get_snapshot_store().get(
+                collection=collection, 
+                version=DATA_VERSION.vectors)
         
-        threed_data_list = []
-        _ = [threed_data_list.append(obj.properties) for obj in threed_response.objects]
-
-        vector_df = pd.DataFrame(threed_data_list)
-
-        vectors_array = np.array(vector_df['vector'].values.tolist())
+        vector_df, vectors_array = vector_snapshot.select(city_name)
 
         if len(vectors_array) <= 3:
             st.write("Insufficient data instances to plot.  Dataset must have at least 3 properties.")
         else:
-            reduced_vectors = TSNE(
-                n_components=3, 
-                learning_rate='auto', 
-                init='pca', 
-                perplexity=3,
-            ).fit_transform(vectors_array)
+            projection_method = st.selectbox(
+                label='Projection',
+                options=available_projection_methods(),
+                help='PCA and randomized SVD are fast. openTSNE and UMAP (if installed) add new listings to an existing embedding without refitting.')
+
+            reduced_vectors = project_vectors(
+                vector_version=DATA_VERSION.vectors,
+                city_name=city_name,
+                method=projection_method,
+                _house_ids=vector_df['house_id'].tolist(),
+                _vectors=vectors_array)
 
             vector_df = pd.concat(
                 [
@@ -528,17 +1340,6 @@ with threedviewer_tab:
 with image_search_tab:
     st.header('Multi-Modal Search')
 
-    display_columns = [
-        'linked_image',
-        'address', 
-        'city',
-        'living_area', 
-        'price', 
-        'price_m2', 
-        'bedroom', 
-        'bathroom', 
-        'energy_label']
-
     if ingest_df.empty:
         
         st.write("⚠️ Select at least a city, transaction type and property type in the side bar.")
@@ -557,55 +1358,99 @@ with image_search_tab:
                 on_click=reset_search
             )
             
+            is_image_search = validators.url(search_string)
+
+            search_engine = st.radio(
+                label='Search mode',
+                options=['Vector', 'Local'] if is_image_search else ['Vector', 'Hybrid', 'Local'],
+                horizontal=True,
+                help='Hybrid search blends keyword (BM25) and vector ranking.  Local search ranks an in-memory snapshot of the vectors exactly, without a round-trip to Weaviate.')
+            
+            if search_engine == 'Hybrid':
+                hybrid_alpha = st.slider(
+                    label='Alpha',
+                    min_value=0.0,
+                    max_value=1.0,
+                    value=0.5,
+                    step=0.05,
+                    help='0 ranks by keyword match only, 1 by vector similarity only.')
+
+            with st.expander('Filters'):
+                search_ranges = {}
+                for name, label, step in [
+                    ('price', 'Price in €', 25000.0), 
+                    ('living_area', 'Living area in m2', 10.0), 
+                    ('bedroom', 'Bedrooms', 1)]:
+                    
+                    #the step's type matches the property's so Weaviate compares like with like
+                    low_col, high_col = st.columns(2)
+                    with low_col:
+                        low = st.number_input(label=f"Minimum {label.lower()}", value=None, min_value=type(step)(0), step=step)
+                    with high_col:
+                        high = st.number_input(label=f"Maximum {label.lower()}", value=None, min_value=type(step)(0), step=step)
+                    if low is not None or high is not None:
+                        search_ranges[name] = (low, high)
+
+                best_label, worst_label = st.select_slider(
+                    label='Energy label',
+                    options=ENERGY_LABELS,
+                    value=(ENERGY_LABELS[0], ENERGY_LABELS[-1]))
+                search_energy_labels = ENERGY_LABELS[ENERGY_LABELS.index(best_label):ENERGY_LABELS.index(worst_label) + 1]
+                if len(search_energy_labels) == len(ENERGY_LABELS):
+                    search_energy_labels = None
+
             st.write("Searching for objects similar to:")
             
-            if city_name.lower() == 'nl':
-                search_filters = None
-            else:
-                search_filters = (
-                        Filter.by_property('city').equal(city_name)
-                        )            
+            #filters are applied by Weaviate so only matching objects are returned
+            search_filters = listing_filter(
+                city_name=city_name, 
+                ranges=search_ranges, 
+                energy_labels=search_energy_labels)
             
-            if validators.url(search_string):
-
+            #query vectors are cached so repeated and refined searches skip CLIP and the image download
+            if is_image_search:
                 st.image(search_string)
-            
-                image_content = requests.get(search_string).content
-                
-                search_image = base64.b64encode(image_content).decode('utf-8')
+                search_vector = get_query_embedder().image_url(url=search_string, load=load_search_image)
+            else:
+                search_vector = get_query_embedder().text(search_string)
                 
-                search_response = collection.query.near_image(
-                    near_image=search_image,
+            if search_engine == 'Local':
+
+                search_df = local_search(
+                    collection=collection,
+                    search_vector=search_vector,
+                    city_name=city_name,
+                    display_columns=search_display_columns,
+                    ranges=search_ranges,
+                    energy_labels=search_energy_labels)
+
+            elif search_engine == 'Hybrid':
+
+                search_response = collection.query.hybrid(
+                    query=search_string,
+                    vector=search_vector,
+                    alpha=hybrid_alpha,
+                    query_properties=HYBRID_QUERY_PROPERTIES,
                     filters=search_filters,
-                    return_properties=display_columns,
+                    return_properties=search_display_columns,
                     limit=5,
-                    return_metadata=MetadataQuery(distance=True)
+                    return_metadata=MetadataQuery(score=True)
                     )
+                
+                search_df = search_response_df(search_response.objects, metric='score')
+
             else:
-                search_response = collection.query.near_text(
-                    query=search_string,
+
+                search_response = collection.query.near_vector(
+                    near_vector=search_vector,
                     filters=search_filters,
-                    return_properties=display_columns,
+                    return_properties=search_display_columns,
                     limit=5,
                     return_metadata=MetadataQuery(distance=True)
-                )
-            
-            _ = [obj.properties.update({'similarity': obj.metadata.distance}) for obj in search_response.objects]
-
-            search_display_list = []
-            _ = [search_display_list.append(obj.properties) for obj in search_response.objects]
-
-            search_df = pd.DataFrame(search_display_list).set_index('linked_image')
-            search_df.index.name = ''
-            
-            if listing_df.empty:
-                st.write('No properties found for the given search criteria')
-            else:
-                st.markdown(
-                    search_df.to_html(
-                        escape=False,
-                        border=0), 
-                    unsafe_allow_html=True
                     )
+                
+                search_df = search_response_df(search_response.objects)
+            
+            show_search_results(search_df)
  
 st.markdown(disclaimer, unsafe_allow_html=True)
@@ -0,0 +1,263 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from fundalytics_images import CACHE_DIR
+
+
+#the multi2vec-clip inference service started by run.sh
+CLIP_INFERENCE_API = os.environ.get('CLIP_INFERENCE_API', 'http://localhost:8081')
+CLIP_TIMEOUT = 60
+
+#rows per /vectorize request and concurrent requests when vectorizing objects for ingest
+CLIP_BATCH_SIZE = int(os.environ.get('FUNDALYTICS_CLIP_BATCH_SIZE', 32))
+CLIP_IN_FLIGHT = int(os.environ.get('FUNDALYTICS_CLIP_IN_FLIGHT', 4))
+CLIP_RETRIES = 2
+CLIP_BACKOFF = 0.5
+
+EMBEDDING_CACHE_ENTRIES = int(os.environ.get('FUNDALYTICS_EMBEDDING_CACHE_ENTRIES', 1024))
+EMBEDDING_CACHE_DB = CACHE_DIR / 'embeddings.sqlite' \
+    if os.environ.get('FUNDALYTICS_EMBEDDING_CACHE_DISK', '1') != '0' else None
+
+class ClipClient:
+    """
+    Client of the multi2vec-clip inference API used by Weaviate, for vectorizing
+    queries and objects outside of Weaviate.
+    """
+
+    def __init__(self, url: str = CLIP_INFERENCE_API, timeout: float = CLIP_TIMEOUT, pool_size: int = CLIP_IN_FLIGHT):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+
+    def vectorize(self, texts: list | None = None, images: list | None = None) -> tuple[list, list]:
+        """
+        Returns (text vectors, image vectors) for the given texts and base64 encoded images.
+        """
+
+        response = self.session.post(
+            f"{self.url}/vectorize",
+            json={'texts': texts or [], 'images': images or []},
+            timeout=self.timeout,
+            )
+        response.raise_for_status()
+        vectors = response.json()
+
+        return vectors.get('textVectors') or [], vectors.get('imageVectors') or []
+
+    def is_ready(self) -> bool:
+        try:
+            return self.session.get(f"{self.url}/.well-known/ready", timeout=5).ok
+        except requests.RequestException:
+            return False
+
+def clip_fields(collection_def: dict) -> tuple[dict, dict]:
+    """
+    Returns ({text field: weight}, {image field: weight}) from the multi2vec-clip module
+    config.  Fields are weighted equally when no weights are given.
+    """
+
+    config = collection_def.get('moduleConfig', {}).get('multi2vec-clip', {})
+    weights = config.get('weights', {})
+
+    fields = []
+    for kind in ['textFields', 'imageFields']:
+        names = config.get(kind, [])
+        fields.append(dict(zip(names, weights.get(kind, [1.0] * len(names)))))
+
+    return fields[0], fields[1]
+
+def vectorize_objects(
+    clip_client: ClipClient,
+    df: pd.DataFrame,
+    collection_def: dict,
+    batch_size: int = CLIP_BATCH_SIZE,
+    max_in_flight: int = CLIP_IN_FLIGHT,
+    retries: int = CLIP_RETRIES,
+    backoff: float = CLIP_BACKOFF,
+    progress: Callable[[int, int], None] | None = None) -> np.ndarray:
+    """
+    Returns a float32 vector per row computed the way multi2vec-clip does on insert: the
+    weighted sum of the CLIP vectors of the row's text and image fields, with the weights
+    of the fields a row actually has normalized to sum to one.  Rows are sent batch_size
+    at a time with up to max_in_flight requests outstanding.  Rows with none of the
+    fields, and rows of batches still failing after retries, get a zero vector so that
+    Weaviate vectorizes them on insert instead.
+    """
+
+    text_fields, image_fields = clip_fields(collection_def)
+    fields = [(name, weight, 'text') for name, weight in text_fields.items()] + \
+        [(name, weight, 'image') for name, weight in image_fields.items()]
+    fields = [field for field in fields if field[0] in df]
+
+    def vectorize_batch(batch_df: pd.DataFrame) -> np.ndarray:
+
+        texts, images, slots = [], [], []
+        for row, data_row in enumerate(batch_df[[name for name, _, _ in fields]].itertuples(index=False)):
+            for (name, weight, kind), value in zip(fields, data_row):
+                if isinstance(value, str) and value:
+                    inputs = texts if kind == 'text' else images
+                    slots.append((row, weight, kind, len(inputs)))
+                    inputs.append(value)
+
+        if not slots:
+            return np.zeros((len(batch_df), 0), dtype=np.float32)
+
+        text_vectors, image_vectors = clip_client.vectorize(texts=texts, images=images)
+        dim = len((text_vectors or image_vectors or [[]])[0])
+
+        vectors = np.zeros((len(batch_df), dim), dtype=np.float32)
+        weights = np.zeros(len(batch_df), dtype=np.float32)
+        for row, weight, kind, i in slots:
+            vectors[row] += weight * np.asarray(text_vectors[i] if kind == 'text' else image_vectors[i], dtype=np.float32)
+            weights[row] += weight
+        weights[weights == 0] = 1
+
+        return vectors / weights[:, None]
+
+    def vectorize_batch_with_retries(batch_df: pd.DataFrame) -> np.ndarray:
+
+        delay = backoff
+        for attempt in range(retries + 1):
+            try:
+                return vectorize_batch(batch_df)
+            except Exception:
+                if attempt == retries:
+                    return np.zeros((len(batch_df), 0), dtype=np.float32)
+                time.sleep(delay)
+                delay *= 2
+
+    batches = [df.iloc[i:i + batch_size] for i in range(0, len(df), batch_size)]
+    results = []
+    done = 0
+    with ThreadPoolExecutor(max_workers=max(1, max_in_flight)) as pool:
+        for vectors in pool.map(vectorize_batch_with_retries, batches):
+            results.append(vectors)
+            done += len(vectors)
+            if progress is not None:
+                progress(done, len(df))
+
+    #rows without any field to vectorize are left as zero vectors
+    dim = max((vectors.shape[1] for vectors in results), default=0)
+    results = [vectors if vectors.shape[1] == dim else np.zeros((len(vectors), dim), dtype=np.float32) 
+               for vectors in results]
+
+    return np.concatenate(results) if results else np.empty((0, dim), dtype=np.float32)
+
+class EmbeddingCache:
+    """
+    LRU cache of query vectors keyed by a hash of the inference service, the kind of
+    query (text, image url or image) and the query itself.  Entries evicted from memory
+    remain in an optional SQLite layer so they survive restarts.
+    """
+
+    def __init__(
+        self, 
+        max_entries: int = EMBEDDING_CACHE_ENTRIES, 
+        db_file=EMBEDDING_CACHE_DB, 
+        namespace: str = CLIP_INFERENCE_API):
+
+        self.max_entries = max_entries
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if db_file is not None:
+            os.makedirs(os.path.dirname(db_file), exist_ok=True)
+            self._db = sqlite3.connect(db_file, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, created REAL)")
+            self._db.commit()
+
+    def key(self, kind: str, query: str) -> str:
+        return hashlib.sha256(f"{self.namespace}\0{kind}\0{query}".encode('utf-8')).hexdigest()
+
+    def get(self, kind: str, query: str) -> list | None:
+        key = self.key(kind, query)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+            row = self._db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone() \
+                if self._db is not None else None
+            if row is None:
+                self.misses += 1
+                return None
+
+            vector = np.frombuffer(row[0], dtype=np.float32).tolist()
+            self._remember(key, vector)
+            self.hits += 1
+            return vector
+
+    def put(self, kind: str, query: str, vector: list):
+        key = self.key(kind, query)
+        with self._lock:
+            self._remember(key, vector)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                    (key, np.asarray(vector, dtype=np.float32).tobytes(), time.time()))
+                self._db.commit()
+
+    def _remember(self, key: str, vector: list):
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+class QueryEmbedder:
+    """
+    Vectorizes search queries with CLIP, going to the inference service only on a
+    cache miss.  Image queries given by url are keyed on the url so that a hit also
+    skips downloading the image.
+    """
+
+    def __init__(self, clip_client: ClipClient, cache: EmbeddingCache):
+        self.clip_client = clip_client
+        self.cache = cache
+
+    def text(self, text: str) -> list:
+        vector = self.cache.get('text', text)
+        if vector is None:
+            (vector, *_), _ = self.clip_client.vectorize(texts=[text])
+            self.cache.put('text', text, vector)
+        return vector
+
+    def image(self, image_enc: str) -> list:
+        image_hash = hashlib.sha256(image_enc.encode('utf-8')).hexdigest()
+        vector = self.cache.get('image', image_hash)
+        if vector is None:
+            _, (vector, *_) = self.clip_client.vectorize(images=[image_enc])
+            self.cache.put('image', image_hash, vector)
+        return vector
+
+    def image_url(self, url: str, load: Callable[[str], str]) -> list:
+        """
+        Returns the vector of the image at url, calling load(url) for its base64
+        encoding only when the url has not been vectorized before.
+        """
+
+        vector = self.cache.get('image_url', url)
+        if vector is None:
+            vector = self.image(load(url))
+            self.cache.put('image_url', url, vector)
+        return vector
@@ -0,0 +1,193 @@
+from collections import defaultdict
+import base64
+import io
+import re
+import numpy as np
+import pandas as pd
+from PIL import Image
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+
+DEDUP_SIMILARITY = 0.97
+DEDUP_BLOCK_ROWS = 4096
+IMAGE_HASH_SIZE = 8
+IMAGE_HASH_DISTANCE = 4
+#a photo on more listings than this is a stock or placeholder image, not a duplicate
+IMAGE_HASH_MAX_SHARED = 20
+#band buckets larger than this are skipped so comparisons stay near linear
+IMAGE_HASH_MAX_BUCKET = 256
+
+def image_hash(image_enc: str, hash_size: int = IMAGE_HASH_SIZE) -> str | None:
+    """
+    Returns the difference hash of a base64 encoded image as a hex string, or None
+    if the image cannot be decoded.  Re-encoded, resized or lightly edited copies of
+    a photo hash to within a few bits of each other.
+    """
+
+    try:
+        image = Image.open(io.BytesIO(base64.b64decode(image_enc)))
+        pixels = np.asarray(
+            image.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS),
+            dtype=np.int16)
+    except Exception:
+        return None
+
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return f"{int(''.join('1' if bit else '0' for bit in bits), 2):0{hash_size * hash_size // 4}x}"
+
+def image_hashes(images: pd.Series) -> pd.Series:
+    return images.map(lambda x: image_hash(x) if isinstance(x, str) else None).astype(object)
+
+def _similar_pairs(vectors: np.ndarray, threshold: float, block_rows: int) -> np.ndarray:
+
+    pairs = [np.empty((0, 2), dtype=np.int64)]
+    for row_start in range(0, len(vectors), block_rows):
+        block = vectors[row_start:row_start + block_rows]
+        for col_start in range(row_start, len(vectors), block_rows):
+            similarity = block @ vectors[col_start:col_start + block_rows].T
+            if col_start == row_start:
+                similarity = np.triu(similarity, k=1)
+            #duplicates are rare, so only the rows holding one are scanned in full
+            candidate_rows = np.flatnonzero(similarity.max(axis=1) >= threshold)
+            rows, cols = np.nonzero(similarity[candidate_rows] >= threshold)
+            pairs.append(np.column_stack([candidate_rows[rows] + row_start, cols + col_start]))
+
+    return np.concatenate(pairs)
+
+def vector_duplicate_pairs(
+    vectors: np.ndarray,
+    threshold: float = DEDUP_SIMILARITY,
+    block_rows: int = DEDUP_BLOCK_ROWS,
+    groups=None) -> np.ndarray:
+    """
+    Returns the (i, j) row pairs, i < j, with cosine similarity of at least threshold.
+    Similarities are computed one block_rows x block_rows tile of the upper triangle at
+    a time, so memory stays bounded however large the collection.  With groups (a key
+    per row, ie. postcode area) only rows of the same group are compared, which turns
+    the quadratic scan into one per group; rows without a group are compared among
+    themselves.
+    """
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    vectors = vectors / norms
+
+    if groups is None:
+        return _similar_pairs(vectors, threshold, block_rows)
+
+    codes, _ = pd.factorize(pd.Series(groups, dtype=object))
+    order = np.argsort(codes, kind='stable')
+    bounds = np.flatnonzero(np.diff(codes[order])) + 1
+
+    pairs = [np.empty((0, 2), dtype=np.int64)]
+    for rows in np.split(order, bounds):
+        if len(rows) > 1:
+            pairs.append(rows[_similar_pairs(vectors[rows], threshold, block_rows)])
+
+    return np.concatenate(pairs)
+
+def postcode_areas(postcodes: pd.Series) -> pd.Series:
+    """
+    Returns the 4 digit area of Dutch postcodes ('1012 AB' -> '1012'), None if missing.
+    """
+
+    return postcodes.map(lambda x: re.sub(r'\s', '', x)[:4] if isinstance(x, str) and x.strip() else None)
+
+def image_duplicate_pairs(
+    hashes: pd.Series,
+    max_distance: int = IMAGE_HASH_DISTANCE,
+    max_shared: int = IMAGE_HASH_MAX_SHARED,
+    max_bucket: int = IMAGE_HASH_MAX_BUCKET) -> np.ndarray:
+    """
+    Returns the (i, j) row pairs, i < j, whose image hashes differ in at most max_distance
+    bits.  Hashes are split into max_distance + 1 bands, any two within max_distance must
+    agree on at least one band, so only rows sharing a band are compared.  Hashes held by
+    more than max_shared rows are ignored, as are bands shared by more than max_bucket rows.
+    """
+
+    counts = hashes.value_counts()
+    shared = set(counts.index[counts > max_shared])
+    values = [int(x, 16) if isinstance(x, str) and x not in shared else None for x in hashes]
+    n_bits = max((len(x) * 4 for x in hashes if isinstance(x, str)), default=0)
+    if not n_bits:
+        return np.empty((0, 2), dtype=np.int64)
+
+    n_bands = max_distance + 1
+    band_bits = -(-n_bits // n_bands)
+
+    candidates = set()
+    for band in range(n_bands):
+        buckets = defaultdict(list)
+        for row, value in enumerate(values):
+            if value is not None:
+                buckets[(value >> (band * band_bits)) & ((1 << band_bits) - 1)].append(row)
+        for rows in buckets.values():
+            if len(rows) > max_bucket:
+                continue
+            candidates.update((i, j) for n, i in enumerate(rows) for j in rows[n + 1:])
+
+    pairs = [(i, j) for i, j in candidates if (values[i] ^ values[j]).bit_count() <= max_distance]
+
+    return np.array(sorted(pairs), dtype=np.int64).reshape(-1, 2)
+
+def cluster_pairs(n_rows: int, pairs: np.ndarray) -> np.ndarray:
+    """
+    Returns a cluster label per row, rows connected through any pair sharing a label.
+    """
+
+    graph = coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(n_rows, n_rows))
+    _, labels = connected_components(graph, directed=False)
+
+    return labels
+
+def find_duplicates(
+    index: pd.DataFrame,
+    vectors: np.ndarray | None = None,
+    threshold: float = DEDUP_SIMILARITY,
+    max_distance: int = IMAGE_HASH_DISTANCE) -> pd.DataFrame:
+    """
+    Returns the rows of index which belong to a duplicate cluster, with cluster and size
+    columns, largest clusters first.  Rows are linked when their vectors are nearly
+    identical or, if index has an image_hash column, their photos are.  If index has a
+    zip column vectors are only compared within a postcode area.
+    """
+
+    pairs = [np.empty((0, 2), dtype=np.int64)]
+    if vectors is not None and len(vectors):
+        pairs.append(vector_duplicate_pairs(
+            vectors, 
+            threshold=threshold,
+            groups=postcode_areas(index['zip']).to_numpy() if 'zip' in index else None))
+    if 'image_hash' in index:
+        pairs.append(image_duplicate_pairs(index['image_hash'], max_distance=max_distance))
+    pairs = np.concatenate(pairs)
+
+    labels = cluster_pairs(len(index), pairs)
+    duplicates_df = index.reset_index(drop=True).assign(cluster=labels)
+    duplicates_df['size'] = duplicates_df.groupby('cluster')['cluster'].transform('size')
+
+    return duplicates_df[duplicates_df['size'] > 1] \
+        .sort_values(['size', 'cluster'], ascending=[False, True]) \
+        .reset_index(drop=True)
+
+def collapse_duplicates(df: pd.DataFrame, max_distance: int = IMAGE_HASH_DISTANCE) -> tuple[pd.DataFrame, int]:
+    """
+    Keeps the first of each group of rows with the same description and near-identical
+    photos, returning (collapsed rows, number of rows dropped).  Rows must have
+    image_hash and descrip columns.
+    """
+
+    if df.empty:
+        return df, 0
+
+    df = df.reset_index(drop=True)
+    pairs = image_duplicate_pairs(df['image_hash'], max_distance=max_distance)
+    descriptions = df['descrip'].fillna('').str.split().str.join(' ').str.lower().to_numpy()
+    pairs = pairs[descriptions[pairs[:, 0]] == descriptions[pairs[:, 1]]] if len(pairs) else pairs
+
+    labels = cluster_pairs(len(df), pairs)
+    keep = ~pd.Series(labels).duplicated().to_numpy()
+
+    return df[keep], int((~keep).sum())
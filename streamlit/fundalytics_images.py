@@ -0,0 +1,377 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from pathlib import Path
+from urllib.parse import urlparse
+import base64
+import hashlib
+import io
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import numpy as np
+from PIL import Image
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+IMAGE_FETCH_WORKERS = 16
+IMAGE_FETCH_PER_HOST = 8
+IMAGE_FETCH_TIMEOUT = (3.05, 10)
+IMAGE_FETCH_RETRIES = 3
+IMAGE_FETCH_BACKOFF = 0.5
+
+CACHE_DIR = Path(os.environ.get('FUNDALYTICS_CACHE_DIR', Path.home() / '.cache' / 'fundalytics'))
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get('FUNDALYTICS_IMAGE_CACHE_MB', 512)) * 1024 * 1024
+
+#CLIP ViT-B-32 resizes to 224px on its shortest side so larger images only cost payload
+IMAGE_SIZE = 224
+IMAGE_QUALITY = int(os.environ.get('FUNDALYTICS_IMAGE_QUALITY', 85))
+IMAGE_PREPROCESS_WORKERS = int(os.environ.get('FUNDALYTICS_IMAGE_PREPROCESS_WORKERS', os.cpu_count() or 1))
+#smaller or flatter images are treated as placeholders
+IMAGE_MIN_SIZE = 32
+IMAGE_MIN_STDDEV = 3.0
+
+class ImageFetcher:
+    """
+    Downloads listing images over a shared keep-alive session.  Concurrency is
+    bounded overall by the thread pool and per host by a semaphore so a single
+    CDN is not flooded.  Transient HTTP errors are retried with exponential backoff.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = IMAGE_FETCH_WORKERS,
+        per_host: int = IMAGE_FETCH_PER_HOST,
+        timeout: tuple = IMAGE_FETCH_TIMEOUT,
+        retries: int = IMAGE_FETCH_RETRIES,
+        backoff_factor: float = IMAGE_FETCH_BACKOFF):
+
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.timeout = timeout
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=['GET'],
+            raise_on_status=False,
+            )
+        adapter = HTTPAdapter(
+            pool_connections=max_workers,
+            pool_maxsize=max_workers,
+            max_retries=retry,
+            )
+
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._host_limits = {}
+        self._lock = threading.Lock()
+
+    def _host_limit(self, url: str) -> threading.Semaphore:
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.BoundedSemaphore(self.per_host)
+            return self._host_limits[host]
+
+    def fetch(self, url: str) -> bytes:
+        with self._host_limit(url):
+            response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        return response.content
+
+    def fetch_many(self, urls) -> tuple[dict, dict]:
+        """
+        Returns ({url: content}, {url: error}) for the unique urls given.  Failures
+        are reported per image rather than raised.
+        """
+
+        unique_urls = list(dict.fromkeys(url for url in urls if isinstance(url, str) and url))
+
+        images = {}
+        failures = {}
+        if not unique_urls:
+            return images, failures
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(unique_urls))) as pool:
+            futures = {pool.submit(self.fetch, url): url for url in unique_urls}
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    images[url] = future.result()
+                except Exception as e:
+                    failures[url] = f"{type(e).__name__}: {e}"
+
+        return images, failures
+
+    def close(self):
+        self.session.close()
+
+class ImageCache:
+    """
+    Content-addressed on-disk cache of base64 encoded images keyed by a hash of
+    the image url.  Entries are evicted least recently used first once the total
+    size exceeds max_bytes.  Urls of rejected (corrupt or placeholder) images are
+    remembered with the reason so they are not downloaded again.
+    """
+
+    def __init__(
+        self, 
+        cache_dir: Path = CACHE_DIR / 'images', 
+        max_bytes: int = IMAGE_CACHE_MAX_BYTES):
+
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._entries = {}
+        for path in self.cache_dir.glob('*/*.b64'):
+            stat = path.stat()
+            self._entries[path.stem] = [stat.st_size, stat.st_mtime]
+        self._size = sum(size for size, _ in self._entries.values())
+
+    @staticmethod
+    def key(url: str) -> str:
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.b64"
+
+    def get(self, url: str) -> str | None:
+        key = self.key(url)
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries[key][1] = time.time()
+        try:
+            path = self._path(key)
+            os.utime(path)
+            return path.read_text()
+        except FileNotFoundError:
+            with self._lock:
+                size, _ = self._entries.pop(key, (0, 0))
+                self._size -= size
+            return None
+
+    def put(self, url: str, content: bytes) -> str:
+        key = self.key(url)
+        image_enc = base64.b64encode(content).decode('utf-8')
+
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=path.parent, delete=False) as f:
+            f.write(image_enc)
+        os.replace(f.name, path)
+
+        with self._lock:
+            size, _ = self._entries.get(key, (0, 0))
+            self._entries[key] = [len(image_enc), time.time()]
+            self._size += len(image_enc) - size
+            self._evict()
+
+        return image_enc
+
+    def rejection(self, url: str) -> str | None:
+        try:
+            return self._path(self.key(url)).with_suffix('.rejected').read_text()
+        except FileNotFoundError:
+            return None
+
+    def reject(self, url: str, reason: str):
+        path = self._path(self.key(url)).with_suffix('.rejected')
+        path.parent.mkdir(exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=path.parent, delete=False) as f:
+            f.write(reason)
+        os.replace(f.name, path)
+
+    def _evict(self):
+        if self._size <= self.max_bytes:
+            return
+        for key, (size, _) in sorted(self._entries.items(), key=lambda x: x[1][1]):
+            if self._size <= self.max_bytes:
+                break
+            self._path(key).unlink(missing_ok=True)
+            del self._entries[key]
+            self._size -= size
+
+class BlobStore:
+    """
+    Content-addressed local store of image files keyed by the sha256 of their bytes, for
+    images kept out of Weaviate.  Identical images are stored once and kept until no
+    imported listing references them.
+    """
+
+    def __init__(self, root: Path = CACHE_DIR / 'blobs'):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(content: bytes) -> str:
+        return hashlib.sha256(content).hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def put(self, content: bytes) -> str:
+        key = self.key(content)
+        path = self.path(key)
+        if not path.exists():
+            path.parent.mkdir(exist_ok=True)
+            with tempfile.NamedTemporaryFile('wb', dir=path.parent, delete=False) as f:
+                f.write(content)
+            os.replace(f.name, path)
+        return key
+
+    def get(self, key: str) -> bytes | None:
+        try:
+            return self.path(key).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def retain(self, keys: set) -> int:
+        """
+        Deletes every blob whose key is not in keys, returning the number deleted.
+        """
+
+        deleted = 0
+        for path in self.root.glob('*/*'):
+            #partially written blobs have temporary names rather than keys
+            if len(path.name) == 64 and path.name not in keys:
+                path.unlink(missing_ok=True)
+                deleted += 1
+        return deleted
+
+def preprocess_image(
+    content: bytes, 
+    size: int = IMAGE_SIZE, 
+    quality: int = IMAGE_QUALITY) -> tuple[bytes | None, str | None]:
+    """
+    Returns (JPEG bytes, None) with the image shrunk to size px on its shortest side, or
+    (None, reason) for corrupt and placeholder images.  Images are never enlarged and the
+    original bytes are kept when re-encoding would not make them smaller.
+    """
+
+    try:
+        image = Image.open(io.BytesIO(content))
+        image.load()
+    except Exception as e:
+        return None, f"corrupt image ({type(e).__name__})"
+
+    if min(image.size) < IMAGE_MIN_SIZE:
+        return None, f"placeholder image ({image.width}x{image.height})"
+    if np.asarray(image.convert('L').resize((64, 64)), dtype=np.float32).std() < IMAGE_MIN_STDDEV:
+        return None, 'placeholder image (blank)'
+
+    scale = size / min(image.size)
+    if scale < 1:
+        image = image.resize(
+            (max(1, round(image.width * scale)), max(1, round(image.height * scale))), 
+            Image.Resampling.LANCZOS)
+
+    output = io.BytesIO()
+    image.convert('RGB').save(output, format='JPEG', quality=quality, optimize=True)
+    processed = output.getvalue()
+
+    return (processed if len(processed) < len(content) else content), None
+
+class ImagePreprocessor:
+    """
+    Runs preprocess_image over a process pool, as decoding and re-encoding is CPU bound.
+    Bytes in and out and dropped images are counted per process.
+    """
+
+    def __init__(
+        self, 
+        max_workers: int = IMAGE_PREPROCESS_WORKERS, 
+        size: int = IMAGE_SIZE, 
+        quality: int = IMAGE_QUALITY):
+
+        self.max_workers = max_workers
+        self.size = size
+        self.quality = quality
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.processed = 0
+        self.dropped = 0
+
+        #spawned workers do not inherit the app's threads and locks as forked ones would
+        self._pool = ProcessPoolExecutor(
+            max_workers=max_workers, 
+            mp_context=multiprocessing.get_context('spawn'))
+        self._lock = threading.Lock()
+
+    def process_many(self, images: dict) -> tuple[dict, dict]:
+        """
+        Returns ({url: preprocessed content}, {url: reason dropped}) for {url: content}.
+        """
+
+        urls = list(images)
+        contents = [images[url] for url in urls]
+        results = self._pool.map(
+            preprocess_image, 
+            contents, 
+            [self.size] * len(urls), 
+            [self.quality] * len(urls),
+            chunksize=max(1, len(urls) // (4 * self.max_workers)))
+
+        processed = {}
+        dropped = {}
+        for url, content, (result, reason) in zip(urls, contents, results):
+            if result is None:
+                dropped[url] = reason
+            else:
+                processed[url] = result
+
+        with self._lock:
+            self.bytes_in += sum(len(content) for content in contents)
+            self.bytes_out += sum(len(content) for content in processed.values())
+            self.processed += len(processed)
+            self.dropped += len(dropped)
+
+        return processed, dropped
+
+    def close(self):
+        self._pool.shutdown()
+
+def fetch_encoded_images(
+    urls, 
+    fetcher: ImageFetcher, 
+    cache: ImageCache, 
+    preprocessor: ImagePreprocessor | None = None) -> tuple[dict, dict]:
+    """
+    Returns ({url: base64 image}, {url: error}), downloading only the images not
+    already held in the cache.  With a preprocessor, downloaded images are shrunk and
+    filtered before they are cached, so the cache should hold preprocessed images only.
+    Images the preprocessor rejects are cached as failures and not downloaded again.
+    """
+
+    encoded = {}
+    failures = {}
+    missing = []
+    for url in dict.fromkeys(url for url in urls if isinstance(url, str) and url):
+        image_enc = cache.get(url)
+        if image_enc is not None:
+            encoded[url] = image_enc
+        elif preprocessor is not None and (reason := cache.rejection(url)) is not None:
+            failures[url] = reason
+        else:
+            missing.append(url)
+
+    images, fetch_failures = fetcher.fetch_many(missing)
+    failures.update(fetch_failures)
+    if preprocessor is not None and images:
+        images, dropped = preprocessor.process_many(images)
+        failures.update(dropped)
+        for url, reason in dropped.items():
+            cache.reject(url, reason)
+
+    for url, content in images.items():
+        encoded[url] = cache.put(url, content)
+
+    return encoded, failures
@@ -0,0 +1,480 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+import hashlib
+import json
+import numbers
+import os
+import queue
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+import numpy as np
+import pandas as pd
+from fundalytics_images import CACHE_DIR
+
+
+#sum-transformers is started with the model named in MODEL_NAME (see Dockerfile)
+SUMMARY_MODEL_NAME = os.environ.get('MODEL_NAME', 'facebook/bart-large-cnn')
+SUMMARY_MAX_TOKENS = 1024
+
+COVER_PHOTO_WIDTH = '180w'
+
+#properties derived after import which are not part of a listing's identity
+DERIVED_PROPERTIES = ['linked_image', 'description_summary', 'content_hash', 'properties_hash', 'image_key']
+
+PROPERTY_UPDATE_WORKERS = 8
+
+#sum-transformers runs one model instance so a few concurrent batches is enough to keep it busy
+SUMMARY_BATCH_SIZE = int(os.environ.get('FUNDALYTICS_SUMMARY_BATCH_SIZE', 8))
+SUMMARY_WORKERS = int(os.environ.get('FUNDALYTICS_SUMMARY_WORKERS', 2))
+SUMMARY_RETRIES = 2
+
+class DataVersion:
+    """
+    Process-wide tokens which change whenever the collection's objects (data) or its
+    vectors change, for use as cache keys of query results.  With a path the tokens are
+    persisted, so caches kept on disk (ie. the vector snapshot) stay valid across restarts.
+    """
+
+    def __init__(self, path: Path | None = None):
+        self.path = Path(path) if path is not None else None
+        try:
+            with open(self.path) as f:
+                versions = json.load(f)
+            self.data, self.vectors = versions['data'], versions['vectors']
+        except (TypeError, FileNotFoundError, ValueError, KeyError):
+            self.data = uuid.uuid4().hex
+            self.vectors = uuid.uuid4().hex
+            self._save()
+
+    def bump(self, vectors: bool = True):
+        self.data = uuid.uuid4().hex
+        if vectors:
+            self.vectors = uuid.uuid4().hex
+        self._save()
+
+    def _save(self):
+        if self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile('w', dir=self.path.parent, delete=False) as f:
+                json.dump({'data': self.data, 'vectors': self.vectors}, f)
+            os.replace(f.name, self.path)
+
+DATA_VERSION = DataVersion(CACHE_DIR / 'data_version.json')
+
+@lru_cache(maxsize=None)
+def get_summary_tokenizer(model_name: str = SUMMARY_MODEL_NAME):
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(model_name, use_fast=True)
+
+def truncate_descriptions(
+    descriptions: pd.Series,
+    max_tokens: int = SUMMARY_MAX_TOKENS,
+    model_name: str = SUMMARY_MODEL_NAME) -> pd.Series:
+    """
+    Cuts each description at the character offset of its last token that fits in the
+    summarizer's input window.  The whole column is tokenized in one batched call.
+    """
+
+    tokenizer = get_summary_tokenizer(model_name)
+    max_length = max_tokens - tokenizer.num_special_tokens_to_add()
+
+    texts = descriptions.fillna('').astype(str).tolist()
+    encodings = tokenizer(
+        texts,
+        add_special_tokens=False,
+        truncation=True,
+        max_length=max_length,
+        return_offsets_mapping=True,
+        return_attention_mask=False,
+        )
+
+    truncated = [
+        text[:offsets[-1][1]] if len(offsets) == max_length else text
+        for text, offsets in zip(texts, encodings['offset_mapping'])
+        ]
+
+    return pd.Series(truncated, index=descriptions.index, name=descriptions.name)
+
+def extract_cover_photos(photos: pd.Series, width: str = COVER_PHOTO_WIDTH) -> pd.Series:
+    """
+    Returns the first image url of the given width from each comma separated
+    "<url> <width>, <url> <width>, ..." photo string, or NaN if there is none.
+    """
+
+    pattern = r'(?:^|,)\s*([^\s,]+)\s+' + re.escape(width) + r'\s*(?=,|$)'
+
+    cover_photos = photos.astype('string').str.extract(pattern, expand=False)
+
+    #missing values are NaN, as elsewhere in the pipeline, rather than the string dtype's pd.NA
+    return pd.Series(cover_photos.to_numpy(dtype=object, na_value=np.nan), index=photos.index, name=photos.name)
+
+def prefetch(iterable: Iterable, depth: int = 1) -> Iterator:
+    """
+    Runs the iterable in a background thread holding at most depth items ahead of
+    the consumer so that producing the next item overlaps with consuming this one.
+    Exceptions raised by the producer are re-raised in the consumer.
+    """
+
+    items = queue.Queue(maxsize=depth)
+    done = object()
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        #gives up once the consumer has stopped rather than blocking on a full queue
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        iterator = iter(iterable)
+        try:
+            #stop is checked before producing, so nothing is produced after the consumer stops
+            while not stop.is_set():
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                if not put(item):
+                    return
+        except BaseException as e:
+            put(e)
+        finally:
+            put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+def _hash_value(value):
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, numbers.Number) and not isinstance(value, bool):
+        return float(value)
+    return str(value)
+
+def hash_rows(df: pd.DataFrame, columns: list) -> pd.Series:
+    """
+    Returns a sha256 per row over the given columns which is stable across imports
+    regardless of column dtypes (ie. 3 and 3.0 hash the same).
+    """
+
+    columns = [column for column in columns if column in df.columns]
+
+    return pd.Series(
+        [
+            hashlib.sha256(json.dumps([_hash_value(value) for value in row]).encode('utf-8')).hexdigest()
+            for row in df[columns].itertuples(index=False, name=None)
+            ],
+        index=df.index,
+        dtype=object)
+
+def content_hashes(df: pd.DataFrame, collection_def: dict) -> pd.Series:
+    """
+    Returns '<text hash>:<image hash>' per row over the vectorized properties.  The parts
+    are kept apart so that a row whose image could not be downloaded can still be
+    compared with its stored object on its text alone.
+    """
+
+    image_fields = [name for name in vectorized_properties(collection_def) if name in image_properties(collection_def)]
+    text_fields = [name for name in vectorized_properties(collection_def) if name not in image_fields]
+
+    return hash_rows(df, text_fields) + ':' + hash_rows(df, image_fields)
+
+def image_properties(collection_def: dict) -> list:
+    return [prop['name'] for prop in collection_def['properties'] if 'blob' in prop['dataType']]
+
+def vectorized_properties(collection_def: dict) -> list:
+    return [prop['name'] for prop in collection_def['properties'] if not prop.get('skip', False)]
+
+def metadata_properties(collection_def: dict) -> list:
+    return [
+        prop['name'] for prop in collection_def['properties'] 
+        if prop.get('skip', False) and prop['name'] not in DERIVED_PROPERTIES
+        ]
+
+def update_properties(
+    collection,
+    collection_def: dict,
+    update_df: pd.DataFrame,
+    columns: list,
+    max_workers: int = PROPERTY_UPDATE_WORKERS) -> dict:
+    """
+    Patches the given non-vectorized columns of existing objects (by the uuid column)
+    without re-importing them.  Returns {uuid: error} for failed updates.
+    """
+
+    vectorized = set(vectorized_properties(collection_def))
+    if vectorized.intersection(columns):
+        raise ValueError(
+            f"Cannot patch vectorized properties {sorted(vectorized.intersection(columns))} "
+            "without re-vectorizing. Use insert_objects instead.")
+
+    columns = [column for column in columns if column in update_df.columns]
+
+    def update(data_row: dict):
+        collection.data.update(
+            uuid=data_row['uuid'],
+            properties={column: data_row[column] for column in columns if not pd.isna(data_row[column])},
+            )
+
+    failures = {}
+    data_rows = update_df[['uuid'] + columns].to_dict('records')
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for data_row, future in [(data_row, pool.submit(update, data_row)) for data_row in data_rows]:
+            try:
+                future.result()
+            except Exception as e:
+                failures[data_row['uuid']] = f"{type(e).__name__}: {e}"
+
+    #bumped once the updates have landed so a rerun meanwhile cannot cache stale rows
+    #under the new version
+    if data_rows:
+        DATA_VERSION.bump(vectors=False)
+
+    return failures
+
+def _summary_batch(weaviate_client, class_name: str, house_ids: list) -> dict:
+
+    summary_response = weaviate_client.graphql_raw_query(f"""
+            {{
+            Get {{
+                {class_name}(
+                limit: {len(house_ids)}
+                where: {{
+                    path: ["house_id"],
+                    operator: ContainsAny,
+                    valueText: {json.dumps(house_ids)}
+                }}
+                ) {{
+                house_id
+                _additional {{
+                    summary(
+                    properties: ["descrip"],
+                    ) {{
+                    result
+                    }}
+                }}
+                }}
+            }}
+            }}""")
+
+    if summary_response.errors:
+        raise RuntimeError(summary_response.errors)
+
+    return {
+        obj['house_id']: obj['_additional']['summary'][0]['result'] 
+        for obj in summary_response.get[class_name] 
+        if obj['_additional']['summary']
+        }
+
+def generate_summaries(
+    weaviate_client,
+    class_name: str,
+    house_ids: list,
+    batch_size: int = SUMMARY_BATCH_SIZE,
+    max_workers: int = SUMMARY_WORKERS,
+    progress: Callable[[int, int], None] | None = None) -> tuple[dict, dict]:
+    """
+    Summarizes the descriptions of many listings with one GraphQL query per batch and
+    several batches in flight.  Returns ({house_id: summary}, {house_id: error}).
+    progress(done, total) is called from the calling thread as batches complete.
+    """
+
+    house_ids = list(dict.fromkeys(house_ids))
+    batches = [house_ids[i:i + batch_size] for i in range(0, len(house_ids), batch_size)]
+
+    summaries = {}
+    failures = {}
+    if not batches:
+        return summaries, failures
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(_summary_batch, weaviate_client, class_name, batch): batch 
+            for batch in batches
+            }
+        #a progress callback may raise (ie. to cancel) so drop the batches not yet started
+        try:
+            for future in as_completed(futures):
+                batch = futures[future]
+                try:
+                    batch_summaries = future.result()
+                except Exception as e:
+                    batch_summaries = {}
+                    failures.update({house_id: f"{type(e).__name__}: {e}" for house_id in batch})
+                summaries.update(batch_summaries)
+                failures.update({
+                    house_id: 'No summary returned' 
+                    for house_id in batch if house_id not in batch_summaries and house_id not in failures
+                    })
+                if progress:
+                    progress(len(summaries) + len(failures), len(house_ids))
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    return summaries, failures
+
+class SummaryCache:
+    """
+    Persistent SQLite store of generated summaries keyed by a hash of the summarizer
+    model and the truncated description.  Hit and miss counts are kept per process.
+    """
+
+    def __init__(self, db_file=CACHE_DIR / 'summaries.sqlite', model_name: str = SUMMARY_MODEL_NAME):
+
+        os.makedirs(os.path.dirname(db_file), exist_ok=True)
+        self.model_name = model_name
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_file, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS summaries (key TEXT PRIMARY KEY, summary TEXT NOT NULL, created REAL)")
+        self._db.commit()
+
+    def key(self, descrip: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{descrip}".encode('utf-8')).hexdigest()
+
+    def get_many(self, descriptions: pd.Series) -> pd.Series:
+        """
+        Returns the cached summary for each description, or NaN where there is none.
+        """
+
+        keys = descriptions.fillna('').astype(str).map(self.key)
+        unique_keys = list(set(keys))
+
+        found = {}
+        with self._lock:
+            for i in range(0, len(unique_keys), 500):
+                chunk = unique_keys[i:i + 500]
+                found.update(self._db.execute(
+                    f"SELECT key, summary FROM summaries WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk).fetchall())
+
+            summaries = keys.map(found).astype(object)
+            self.hits += int(summaries.notna().sum())
+            self.misses += int(summaries.isna().sum())
+
+        return summaries
+
+    def put_many(self, descriptions: pd.Series, summaries: pd.Series):
+
+        rows = [
+            (self.key(descrip if isinstance(descrip, str) else ''), summary, time.time())
+            for descrip, summary in zip(descriptions, summaries) if isinstance(summary, str)
+            ]
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO summaries VALUES (?, ?, ?)", rows)
+            self._db.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM summaries").fetchone()[0]
+
+class SummaryFiller:
+    """
+    Summarizes queued listings in a background thread, a batch at a time, so that the
+    UI does not wait for the whole import to be summarized.  Listings on screen can be
+    moved to the front of the queue with prioritize().  A batch whose handler raises is
+    requeued up to retries times, after which its listings are recorded in failed.
+    """
+
+    def __init__(self, batch_size: int = SUMMARY_BATCH_SIZE * SUMMARY_WORKERS, retries: int = SUMMARY_RETRIES):
+
+        self.batch_size = batch_size
+        self.retries = retries
+        self.done = {}
+        self.failed = {}
+
+        self._queue = []
+        self._in_flight = []
+        self._attempts = {}
+        self._handler = None
+        self._generation = 0
+        self._condition = threading.Condition()
+
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def start(self, handler: Callable[[list], dict], house_ids: list):
+        """
+        Replaces the queue with house_ids.  handler(house_ids) must summarize and store
+        the given listings and return {house_id: summary}.
+        """
+
+        with self._condition:
+            self._generation += 1
+            self._handler = handler
+            self._queue = list(dict.fromkeys(house_ids))
+            self._in_flight = []
+            self._attempts = {}
+            self.done = {}
+            self.failed = {}
+            self._condition.notify_all()
+
+    def prioritize(self, house_ids: list):
+
+        with self._condition:
+            queued = set(self._queue)
+            first = [house_id for house_id in dict.fromkeys(house_ids) if house_id in queued]
+            first_set = set(first)
+            self._queue = first + [house_id for house_id in self._queue if house_id not in first_set]
+
+    @property
+    def pending(self) -> int:
+        with self._condition:
+            return len(self._queue) + len(self._in_flight)
+
+    def _run(self):
+
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._queue)
+                batch = self._queue[:self.batch_size]
+                del self._queue[:self.batch_size]
+                self._in_flight = batch
+                handler = self._handler
+                generation = self._generation
+
+            try:
+                summaries, error = handler(batch), None
+            except Exception as e:
+                summaries, error = {}, e
+
+            with self._condition:
+                if generation != self._generation:
+                    continue
+
+                self._in_flight = []
+                if error is None:
+                    self.done.update({house_id: summaries.get(house_id) for house_id in batch})
+                else:
+                    attempts = max(self._attempts.get(house_id, 0) for house_id in batch) + 1
+                    if attempts <= self.retries:
+                        #retried after the rest of the queue, so a flaky batch does not stall it
+                        self._attempts.update({house_id: attempts for house_id in batch})
+                        self._queue.extend(batch)
+                    else:
+                        self.failed.update({house_id: str(error) for house_id in batch})
+                self._condition.notify_all()
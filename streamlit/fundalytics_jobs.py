@@ -0,0 +1,141 @@
+from collections import OrderedDict
+from typing import Callable
+import threading
+import time
+import uuid
+
+
+JOB_HISTORY = 20
+
+class JobCancelled(Exception):
+    pass
+
+class Job:
+    """
+    State of a background job shared between its worker thread and any number of
+    Streamlit sessions polling it.  Work is reported per named stage as done/total
+    counts from which rates are derived.
+    """
+
+    def __init__(self, name: str, params: dict):
+
+        self.id = uuid.uuid4().hex[:8]
+        self.name = name
+        self.params = params
+        self.status = 'pending'
+        self.error = None
+        self.result = {}
+        self.messages = []
+        self.created = time.time()
+        self.finished = None
+
+        self._stages = OrderedDict()
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    def stage(self, name: str, total: int | None = None):
+        with self._lock:
+            self._stages[name] = {'done': 0, 'total': total, 'started': time.time(), 'finished': None}
+
+    def advance(self, name: str, n: int = 1, total: int | None = None):
+        with self._lock:
+            if name not in self._stages:
+                self._stages[name] = {'done': 0, 'total': None, 'started': time.time(), 'finished': None}
+            self._stages[name]['done'] += n
+            if total is not None:
+                self._stages[name]['total'] = total
+
+    def update(self, name: str, done: int, total: int | None = None):
+        with self._lock:
+            if name not in self._stages:
+                self._stages[name] = {'done': 0, 'total': None, 'started': time.time(), 'finished': None}
+            self._stages[name]['done'] = done
+            if total is not None:
+                self._stages[name]['total'] = total
+
+    def finish_stage(self, name: str):
+        with self._lock:
+            if name in self._stages and self._stages[name]['finished'] is None:
+                self._stages[name]['finished'] = time.time()
+
+    def log(self, message: str):
+        with self._lock:
+            self.messages.append(message)
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled(f"Job {self.id} was cancelled.")
+
+    @property
+    def running(self) -> bool:
+        return self.status in ('pending', 'running')
+
+    def progress(self) -> list:
+        with self._lock:
+            stages = [dict(stage, name=name) for name, stage in self._stages.items()]
+        for stage in stages:
+            elapsed = (stage['finished'] or time.time()) - stage['started']
+            stage['elapsed'] = elapsed
+            stage['rate'] = stage['done'] / elapsed if elapsed > 0 else 0.0
+        return stages
+
+class JobRunner:
+    """
+    Process-wide registry running each job in its own daemon thread so jobs outlive
+    the script run, and the session, which started them.  Sessions look up their own
+    jobs by id.
+    """
+
+    def __init__(self, history: int = JOB_HISTORY):
+        self.history = history
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, name: str, target: Callable, params: dict | None = None, **kwargs) -> Job:
+        """
+        Starts target(job, **kwargs) in a new thread.
+        """
+
+        job = Job(name=name, params=params or {})
+
+        def run():
+            job.status = 'running'
+            try:
+                target(job, **kwargs)
+                job.status = 'completed'
+            except JobCancelled:
+                job.status = 'cancelled'
+            except Exception as e:
+                job.error = f"{type(e).__name__}: {e}"
+                job.status = 'failed'
+            finally:
+                job.finished = time.time()
+
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.history:
+                self._jobs.popitem(last=False)
+
+        threading.Thread(target=run, name=f"{name}-{job.id}", daemon=True).start()
+
+        return job
+
+    def get(self, job_id: str | None) -> Job | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def latest(self, name: str) -> Job | None:
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if job.name == name]
+        return jobs[-1] if jobs else None
+
+    def running(self, name: str) -> Job | None:
+        job = self.latest(name)
+        return job if job and job.running else None
@@ -0,0 +1,385 @@
+from pathlib import Path
+from typing import Iterator
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import numpy as np
+import pandas as pd
+from fundalytics_images import CACHE_DIR
+
+
+FETCH_PAGE_SIZE = int(os.environ.get('FUNDALYTICS_FETCH_PAGE_SIZE', 1000))
+
+SNAPSHOT_DIR = CACHE_DIR / 'snapshot'
+SNAPSHOT_PROPERTIES = ['house_id', 'city', 'url', 'price']
+
+SEARCH_BLOCK_ROWS = 16384
+
+def iter_object_pages(
+    collection,
+    return_properties: list,
+    include_vector: bool = False,
+    page_size: int = FETCH_PAGE_SIZE) -> Iterator[list]:
+    """
+    Yields the collection's objects a page at a time using the cursor API (paging
+    after the last uuid seen) so there is no upper limit on the number of objects.
+    """
+
+    after = None
+    while True:
+        response = collection.query.fetch_objects(
+            after=after,
+            limit=page_size,
+            include_vector=include_vector,
+            return_properties=return_properties,
+            )
+        if not response.objects:
+            return
+        yield response.objects
+        if len(response.objects) < page_size:
+            return
+        after = response.objects[-1].uuid
+
+def _tokens(text) -> set:
+    #Weaviate's word tokenization splits on anything but unicode letters and digits
+    return set(re.findall(r'[^\W_]+', text.lower())) if isinstance(text, str) else set()
+
+def city_mask(cities: pd.Series, city_name: str) -> pd.Series:
+    """
+    Client-side equivalent of Filter.by_property('city').equal(city_name) on a word
+    tokenized property, as the cursor API does not support filters.  'nl' matches all.
+    """
+
+    if city_name.lower() == 'nl':
+        return pd.Series(True, index=cities.index)
+
+    query_tokens = _tokens(city_name)
+    return cities.map(lambda city: query_tokens.issubset(_tokens(city))).astype(bool)
+
+def fetch_dataframe(
+    collection,
+    return_properties: list,
+    city_name: str = 'nl',
+    page_size: int = FETCH_PAGE_SIZE) -> pd.DataFrame:
+
+    fetch_properties = list(dict.fromkeys(return_properties + ['city']))
+
+    chunks = []
+    for objects in iter_object_pages(collection, return_properties=fetch_properties, page_size=page_size):
+        chunk = pd.DataFrame([obj.properties for obj in objects], columns=fetch_properties)
+        chunks.append(chunk[city_mask(chunk['city'], city_name)][return_properties])
+
+    if not chunks:
+        return pd.DataFrame(columns=return_properties)
+
+    return pd.concat(chunks, ignore_index=True)
+
+class VectorSnapshot:
+    """
+    The collection's vectors as a float32 (n, dim) .npy file, memory-mapped read-only,
+    next to an index DataFrame of the objects' properties with one row per vector.
+    """
+
+    def __init__(self, path: Path, version: str, index: pd.DataFrame, vectors: np.ndarray):
+        self.path = Path(path)
+        self.version = version
+        self.index = index
+        self.vectors = vectors
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @classmethod
+    def build(
+        cls,
+        collection,
+        version: str,
+        path: Path = SNAPSHOT_DIR,
+        properties: list = SNAPSHOT_PROPERTIES,
+        page_size: int = FETCH_PAGE_SIZE,
+        vector_name: str = 'default') -> 'VectorSnapshot':
+        """
+        Pages through the collection writing each vector straight into the memory-mapped
+        file, so no intermediate lists or float64 copies are made.
+        """
+
+        path = Path(path)
+        build_path = path.with_name(path.name + '.build')
+        shutil.rmtree(build_path, ignore_errors=True)
+        build_path.mkdir(parents=True)
+
+        capacity = collection.aggregate.over_all(total_count=True).total_count or 0
+
+        vectors = None
+        n_rows = 0
+        chunks = []
+        for objects in iter_object_pages(
+            collection, 
+            return_properties=properties, 
+            include_vector=True, 
+            page_size=page_size):
+
+            if vectors is None:
+                dim = len(objects[0].vector[vector_name])
+                vectors = np.lib.format.open_memmap(
+                    build_path / 'vectors.npy', mode='w+', dtype=np.float32, 
+                    shape=(max(capacity, len(objects)), dim))
+
+            elif n_rows + len(objects) > len(vectors):
+                #objects were added while paging
+                grown = np.lib.format.open_memmap(
+                    build_path / 'vectors.grow.npy', mode='w+', dtype=np.float32,
+                    shape=(2 * (n_rows + len(objects)), vectors.shape[1]))
+                grown[:n_rows] = vectors[:n_rows]
+                del vectors
+                os.replace(build_path / 'vectors.grow.npy', build_path / 'vectors.npy')
+                vectors = grown
+
+            for i, obj in enumerate(objects):
+                vectors[n_rows + i] = obj.vector[vector_name]
+            n_rows += len(objects)
+
+            chunks.append(pd.DataFrame([obj.properties for obj in objects], columns=properties))
+
+        if vectors is None:
+            np.save(build_path / 'vectors.npy', np.empty((0, 0), dtype=np.float32))
+        else:
+            vectors.flush()
+            del vectors
+
+        index = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=properties)
+        index.to_json(build_path / 'index.json', orient='split', index=False)
+        with open(build_path / 'meta.json', 'w') as f:
+            json.dump({'version': version, 'count': n_rows}, f)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(build_path, path)
+
+        return cls.load(path)
+
+    @classmethod
+    def load(cls, path: Path = SNAPSHOT_DIR) -> 'VectorSnapshot | None':
+
+        path = Path(path)
+        try:
+            with open(path / 'meta.json') as f:
+                meta = json.load(f)
+            vectors = np.load(path / 'vectors.npy', mmap_mode='r')
+            index = pd.read_json(path / 'index.json', orient='split', dtype=False)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        return cls(path=path, version=meta['version'], index=index, vectors=vectors[:meta['count']])
+
+    def select(self, city_name: str = 'nl') -> tuple[pd.DataFrame, np.ndarray]:
+        """
+        Returns the index rows and vectors for a city.  'nl' returns the memory-mapped
+        matrix itself rather than a copy.
+        """
+
+        if city_name.lower() == 'nl':
+            return self.index, self.vectors
+
+        mask = city_mask(self.index['city'], city_name).to_numpy()
+        return self.index[mask].reset_index(drop=True), self.vectors[mask]
+
+class LocalVectorIndex:
+    """
+    Exact in-process cosine search over a snapshot's vectors, held as a normalized
+    float32 matrix and scanned in blocks.  Distances match Weaviate's cosine distance.
+    """
+
+    def __init__(self, snapshot: VectorSnapshot, block_rows: int = SEARCH_BLOCK_ROWS):
+
+        self.version = snapshot.version
+        self.index = snapshot.index
+        self.block_rows = block_rows
+
+        vectors = np.asarray(snapshot.vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True) if vectors.size else np.ones((len(vectors), 1))
+        norms[norms == 0] = 1
+        self.vectors = (vectors / norms).astype(np.float32, copy=False)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def search(
+        self, 
+        query_vector, 
+        k: int = 5, 
+        city_name: str = 'nl', 
+        exclude: list | None = None,
+        include: list | None = None) -> pd.DataFrame:
+        """
+        Returns the index rows of the k nearest vectors, nearest first, with a distance column.
+        If include is given only those house_ids are considered.
+        """
+
+        if not len(self):
+            return self.index.assign(distance=pd.Series(dtype=np.float32))
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1)
+
+        mask = city_mask(self.index['city'], city_name).to_numpy()
+        if exclude:
+            mask &= ~self.index['house_id'].isin(exclude).to_numpy()
+        if include is not None:
+            mask &= self.index['house_id'].isin(include).to_numpy()
+
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, len(self.vectors), self.block_rows):
+            scores = self.vectors[start:start + self.block_rows] @ query
+            scores[~mask[start:start + self.block_rows]] = -np.inf
+            top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k]
+            best_rows = np.concatenate([best_rows, top + start])
+            best_scores = np.concatenate([best_scores, scores[top]])
+
+        order = np.argsort(-best_scores, kind='stable')[:k]
+        order = order[np.isfinite(best_scores[order])]
+
+        return self.index.iloc[best_rows[order]].assign(distance=1 - best_scores[order]).reset_index(drop=True)
+
+class SnapshotStore:
+    """
+    Process-wide holder of the current snapshot and its local search index, rebuilt
+    when the vector version changes.  DATA_VERSION persists that version, so the
+    snapshot on disk is reused after a restart.
+    """
+
+    def __init__(self, path: Path = SNAPSHOT_DIR):
+        self.path = Path(path)
+        self._snapshot = None
+        self._index = None
+        self._lock = threading.Lock()
+
+    def get(self, collection, version: str) -> VectorSnapshot:
+        with self._lock:
+            if self._snapshot is None:
+                #a snapshot persisted by an earlier run is only trusted while it still
+                #holds as many vectors as the collection has objects
+                snapshot = VectorSnapshot.load(self.path)
+                if snapshot is not None and \
+                    len(snapshot) == (collection.aggregate.over_all(total_count=True).total_count or 0):
+                    self._snapshot = snapshot
+            if self._snapshot is None or self._snapshot.version != version:
+                self._snapshot = None
+                self._snapshot = VectorSnapshot.build(collection=collection, version=version, path=self.path)
+            return self._snapshot
+
+    def get_index(self, collection, version: str) -> LocalVectorIndex:
+        snapshot = self.get(collection=collection, version=version)
+        with self._lock:
+            if self._index is None or self._index.version != snapshot.version:
+                self._index = LocalVectorIndex(snapshot)
+            return self._index
+
+#fraction of new points above which an existing embedding is refit rather than extended
+PROJECTION_REFIT_FRACTION = 0.25
+TSNE_PERPLEXITY = 3
+
+def available_projection_methods() -> list:
+
+    methods = ['t-SNE', 'PCA', 'Randomized SVD']
+    try:
+        import openTSNE
+        methods.append('openTSNE')
+    except ImportError:
+        pass
+    try:
+        import umap
+        methods.append('UMAP')
+    except ImportError:
+        pass
+
+    return methods
+
+def _fit_projection(vectors: np.ndarray, method: str) -> tuple[np.ndarray, object]:
+    """
+    Returns the 3D coordinates of vectors and, if the method can place new points in
+    an existing embedding, the fitted model.
+    """
+
+    if method == 'PCA':
+        from sklearn.decomposition import PCA
+        model = PCA(n_components=3)
+        return model.fit_transform(vectors), model
+
+    elif method == 'Randomized SVD':
+        from sklearn.decomposition import TruncatedSVD
+        model = TruncatedSVD(n_components=3, algorithm='randomized')
+        return model.fit_transform(vectors), model
+
+    elif method == 't-SNE':
+        from sklearn.manifold import TSNE
+        coords = TSNE(
+            n_components=3, 
+            learning_rate='auto', 
+            init='pca', 
+            perplexity=TSNE_PERPLEXITY,
+        ).fit_transform(vectors)
+        return coords, None
+
+    elif method == 'openTSNE':
+        from openTSNE import TSNE
+        model = TSNE(
+            n_components=3, 
+            perplexity=TSNE_PERPLEXITY, 
+            negative_gradient_method='bh',
+        ).fit(vectors)
+        return np.asarray(model), model
+
+    elif method == 'UMAP':
+        import umap
+        model = umap.UMAP(n_components=3, n_neighbors=min(15, len(vectors) - 1)).fit(vectors)
+        return model.embedding_, model
+
+    raise ValueError(f"Unknown projection method {method}. Choose from {available_projection_methods()}.")
+
+def _fingerprint(vector: np.ndarray) -> bytes:
+    return hashlib.blake2b(np.ascontiguousarray(vector, dtype=np.float32).tobytes(), digest_size=8).digest()
+
+class Projector:
+    """
+    Projects vectors to 3D, keeping the last fit per key so that a small number of new
+    points can be placed into the existing embedding instead of refitting.
+    """
+
+    def __init__(self, refit_fraction: float = PROJECTION_REFIT_FRACTION):
+        self.refit_fraction = refit_fraction
+        self._fits = {}
+        self._lock = threading.Lock()
+
+    def project(self, key, ids: list, vectors: np.ndarray, method: str) -> np.ndarray:
+        with self._lock:
+            return self._project(key, ids, vectors, method)
+
+    def _project(self, key, ids: list, vectors: np.ndarray, method: str) -> np.ndarray:
+
+        #points are reused by house_id and vector fingerprint so changed listings move
+        fingerprints = [_fingerprint(vector) for vector in vectors]
+        previous = self._fits.get((key, method))
+        if previous is not None:
+            previous_coords, model = previous
+            new_rows = [
+                i for i, point in enumerate(zip(ids, fingerprints)) if point not in previous_coords]
+            if model is not None and len(new_rows) <= self.refit_fraction * len(ids):
+                coords = np.empty((len(ids), 3), dtype=np.float32)
+                for i, point in enumerate(zip(ids, fingerprints)):
+                    if point in previous_coords:
+                        coords[i] = previous_coords[point]
+                if new_rows:
+                    coords[new_rows] = np.asarray(model.transform(vectors[new_rows]))
+                    previous_coords.update(
+                        ((ids[i], fingerprints[i]), coords[i]) for i in new_rows)
+                return coords
+
+        coords, model = _fit_projection(vectors, method)
+        coords = np.asarray(coords, dtype=np.float32)
+        self._fits[(key, method)] = (dict(zip(zip(ids, fingerprints), coords)), model)
+
+        return coords
@@ -0,0 +1,125 @@
+import threading
+import time
+import requests
+import weaviate
+from weaviate.embedded import EmbeddedOptions
+
+
+WEAVIATE_CONNECT_RETRIES = 5
+WEAVIATE_CONNECT_BACKOFF = 0.5
+WEAVIATE_HEALTH_INTERVAL = 5.0
+
+#property settings which can only be changed by recreating the collection
+SCHEMA_SETTINGS = ['dataType', 'tokenization', 'indexFilterable', 'indexSearchable', 'indexRangeFilters']
+
+def schema_differences(schema: dict, collection_def: dict) -> list:
+    """
+    Returns the names of the properties of collection_def which are missing from schema,
+    a collection's schema as returned by Weaviate, or whose settings differ.  Settings
+    collection_def leaves to Weaviate's defaults are not compared.
+    """
+
+    stored = {prop['name']: prop for prop in schema.get('properties', [])}
+
+    return [
+        prop['name'] for prop in collection_def['properties']
+        if prop['name'] not in stored or any(
+            prop[setting] != stored[prop['name']].get(setting) for setting in SCHEMA_SETTINGS if setting in prop)
+        ]
+
+class SharedWeaviateClient:
+    """
+    Process-wide Weaviate client shared by every session and background job, so they
+    all use one connection and gRPC channel.  Liveness is checked at most every
+    health_interval seconds and a dead connection is reopened with exponential
+    backoff, starting the embedded instance again if it has stopped.  The old client is
+    closed on reconnect, so long running work should call get() for each use rather
+    than hold on to the client or its collections.
+    """
+
+    def __init__(
+        self,
+        embedded_options: EmbeddedOptions,
+        retries: int = WEAVIATE_CONNECT_RETRIES,
+        backoff: float = WEAVIATE_CONNECT_BACKOFF,
+        health_interval: float = WEAVIATE_HEALTH_INTERVAL):
+
+        self.embedded_options = embedded_options
+        self.retries = retries
+        self.backoff = backoff
+        self.health_interval = health_interval
+        self.startup_seconds = None
+        self.reconnects = 0
+
+        self._client = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> weaviate.WeaviateClient:
+
+        with self._lock:
+            if self._client is None:
+                start = time.perf_counter()
+                self._client = self._connect()
+                self.startup_seconds = time.perf_counter() - start
+
+            elif time.monotonic() - self._checked > self.health_interval and not self._is_live():
+                try:
+                    self._client.close()
+                except Exception:
+                    pass
+                self._client = self._connect()
+                self.reconnects += 1
+
+            self._checked = time.monotonic()
+            return self._client
+
+    def _is_live(self) -> bool:
+        #a connection error on the liveness probe means the instance is down, not a failed rerun
+        try:
+            return self._client.is_live()
+        except Exception:
+            return False
+
+    def _connect(self) -> weaviate.WeaviateClient:
+
+        delay = self.backoff
+        for attempt in range(self.retries):
+            try:
+                client = weaviate.WeaviateClient(embedded_options=self.embedded_options)
+                try:
+                    client.connect()
+                except weaviate.exceptions.WeaviateStartUpError as e:
+                    #only an embedded instance left running by an earlier process, which already
+                    #holds the ports, is attached to, other start up failures are retried
+                    if 'already listening' not in str(e):
+                        raise
+                    client.close()
+                    client = weaviate.connect_to_local(
+                        port=self.embedded_options.port,
+                        grpc_port=self.embedded_options.grpc_port)
+                return client
+
+            except Exception:
+                if attempt == self.retries - 1:
+                    raise
+                time.sleep(delay)
+                delay *= 2
+
+    def schema(self, class_name: str) -> dict:
+        """
+        Returns the collection's schema as stored by Weaviate.  The client's parsed
+        config leaves out settings such as indexRangeFilters, so the REST API is used.
+        """
+
+        response = requests.get(
+            f"http://{self.embedded_options.hostname}:{self.embedded_options.port}/v1/schema/{class_name}",
+            timeout=10)
+        response.raise_for_status()
+        return response.json()
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None